@@ -1,60 +1,301 @@
 import os
-import requests
-import json
-import datetime
+import hashlib
+import time
 
+from functools import wraps
 
-from flask import Flask, session, flash, jsonify, redirect, render_template, request
-from flask_session import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
-from werkzeug.security import check_password_hash, generate_password_hash
+from flask import Blueprint, Flask, Markup, current_app, session, flash, jsonify, redirect, render_template, request, send_file, send_from_directory
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
+from werkzeug.local import LocalProxy
+
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from database import Database, QueryPool, QueryPoolFull
+from helpers import star_img, review_date, validate_pass, page_request, page_cursors, date_key, text_key
+import queries
+from ratings import RatingCache, NO_RATING
+from sampling import BookSampler
+from recommender import recommend
+from search import SEARCH_FIELDS, search_books, search_author_books
+from sessions import init_sessions
+from passwords import PasswordHasher, HasherBusy, DEFAULT_METHOD, DEFAULT_SALT_LENGTH
+from metrics import Metrics
+from page_cache import PageCache
+from covers import CoverStore
+from assets import Assets
+
+
+# Values of an on/off setting that turn it off, in any case:
+OFF_VALUES = ("", "0", "false", "no", "off")
+
+
+def flag(value):
+    """Parse an on/off setting - anything but an empty string, 0, false, no or off is on"""
+    return value.strip().lower() not in OFF_VALUES
+
+
+# App settings - (type, default) of each, read from the environment variable of the same name unless given to create_app:
+SETTINGS = {
+    "DATABASE_URL": (str, None),
+    "DATABASE_REPLICA_URLS": (str, ""),
+    "API_KEY": (str, None),
+    "SECRET_KEY": (str, None),
+    "SESSION_BACKEND": (str, "cookie"),
+    "DB_POOL_SIZE": (int, 5),
+    "DB_MAX_OVERFLOW": (int, 10),
+    "DB_POOL_TIMEOUT": (int, 30),
+    "DB_POOL_RECYCLE": (int, 1800),
+    "DB_POOL_PRE_PING": (flag, True),
+    "PASSWORD_METHOD": (str, DEFAULT_METHOD),
+    "PASSWORD_SALT_LENGTH": (int, DEFAULT_SALT_LENGTH),
+    "PASSWORD_WORKERS": (int, 2),
+    "PASSWORD_QUEUE": (int, 16),
+    "QUERY_WORKERS": (int, 8),
+    "QUERY_WAIT": (float, 0.5),
+    "QUERY_TIMEOUT": (float, 10),
+    "RATING_WORKERS": (int, 4),
+    "RATING_QUEUE": (int, 16),
+    "RATING_DEADLINE": (float, 1.5),
+    "PAGE_CACHE_MB": (int, 64),
+    "PAGE_CACHE_TTL": (int, 60),
+    "COVER_CACHE_DIR": (str, None),
+    "SLOW_REQUEST_MS": (int, 500),
+    "MAX_REQUEST_STATEMENTS": (int, 20),
+    "READ_YOUR_WRITES_SECONDS": (int, 10),
+    "PRELOAD": (flag, False),
+}
+
+# Routes that only read, whose queries can be answered by a read replica:
+READ_ONLY_ROUTES = {"readrate.index", "readrate.search", "readrate.book_details", "readrate.author_details", "readrate.user_details",
+                    "readrate.book_api", "readrate.books_api", "readrate.book_reviews_api"}
+
+# Routes whose pages are cached for logged out users:
+CACHED_PAGES = ("readrate.index", "readrate.author_details", "readrate.book_details")
+
+# Most ISBNs looked up by one batch API request:
+API_BATCH_SIZE = 100
+
+# Seconds API responses may be reused by caches before revalidating:
+API_MAX_AGE = 60
+
+views = Blueprint("readrate", __name__)
+
+
+def env_config():
+    """Return the SETTINGS from their environment variables, or their defaults"""
+
+    return dict((name, cast(os.environ[name]) if name in os.environ else default) for name, (cast, default) in SETTINGS.items())
+
+
+class Components:
+    """
+    The database, caches and worker pools of an app, made from its config by
+    create_app and kept in app.extensions["readrate"]. None of them connect
+    to the database or start threads or processes until they are first used.
+    """
+
+    def __init__(self, app):
+        config = app.config
+
+        # Set up database - writes go to the primary, and reads from read-only routes to any replicas:
+        replica_urls = config["DATABASE_REPLICA_URLS"]
+        if isinstance(replica_urls, str):
+            replica_urls = [url for url in replica_urls.split(",") if url]
+
+        self.database = Database(config["DATABASE_URL"],
+                                 replica_urls=replica_urls,
+                                 pool_size=config["DB_POOL_SIZE"],
+                                 max_overflow=config["DB_MAX_OVERFLOW"],
+                                 pool_timeout=config["DB_POOL_TIMEOUT"],
+                                 pool_recycle=config["DB_POOL_RECYCLE"],
+                                 pool_pre_ping=config["DB_POOL_PRE_PING"])
+        self.db = self.database.session
+
+        # Request latency, SQL, HTTP and template times of this app, served on /metrics:
+        self.metrics = Metrics(slow_ms=config["SLOW_REQUEST_MS"], max_statements=config["MAX_REQUEST_STATEMENTS"])
+
+        # Sample home page books from pools kept in memory:
+        self.book_sampler = BookSampler(self.db)
+
+        # Hash passwords in a bounded pool of worker processes:
+        self.password_hasher = PasswordHasher(method=config["PASSWORD_METHOD"],
+                                              salt_length=config["PASSWORD_SALT_LENGTH"],
+                                              workers=config["PASSWORD_WORKERS"],
+                                              max_queue=config["PASSWORD_QUEUE"])
+
+        # Run a request's independent queries at the same time, on separate connections:
+        self.query_pool = QueryPool(self.database, workers=config["QUERY_WORKERS"], wrap=lambda func: self.metrics.bind(in_app_context(func)))
+
+        # GoodReads lookups get their own workers, as a slow scrape carries on after the page has given up on it and
+        # mustn't hold up other requests' queries - once RATING_QUEUE lookups are pending, pages show N/A straight away:
+        self.rating_pool = QueryPool(self.database, workers=config["RATING_WORKERS"], wrap=lambda func: self.metrics.bind(in_app_context(func)),
+                                     max_pending=config["RATING_QUEUE"], name="rating")
+
+        # Cache GoodReads ratings so repeat views of a book don't leave the process - stale ones are refreshed on the rating pool:
+        self.rating_cache = RatingCache(self.db, metrics=self.metrics, pool=self.rating_pool)
+
+        # Cache logged out renders of the home, book and author pages, and book cards, in memory:
+        self.page_cache = PageCache(max_bytes=config["PAGE_CACHE_MB"] * 1024 * 1024, ttl=config["PAGE_CACHE_TTL"])
+
+        # Serve book covers from a disk cache, fetching each from Open Library once:
+        self.cover_store = CoverStore(config["COVER_CACHE_DIR"] or os.path.join(app.root_path, "cover_cache"), metrics=self.metrics)
+
+        # Serve fingerprinted, precompressed static files, once assets.py has built them:
+        self.assets = Assets()
+
+
+def component(name):
+    """Proxy for one of the current app's Components, so views use them like module globals"""
+
+    return LocalProxy(lambda: getattr(current_app.extensions["readrate"], name))
+
+
+database = component("database")
+db = component("db")
+rating_cache = component("rating_cache")
+book_sampler = component("book_sampler")
+password_hasher = component("password_hasher")
+query_pool = component("query_pool")
+rating_pool = component("rating_pool")
+page_cache = component("page_cache")
+cover_store = component("cover_store")
+
+
+def in_app_context(func):
+    """Wrap func to run in the current app's context, for running it on a worker thread"""
+
+    app = current_app._get_current_object()
+
+    @wraps(func)
+    def wrapped(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+
+    return wrapped
+
+
+def create_app(config=None):
+    """
+    Create the READ-RATE app. Settings not in config are read from the
+    environment (see SETTINGS). Creating an app doesn't connect to the
+    database - that happens on its first request, or in preload().
+    """
+
+    app = Flask(__name__, static_folder='static')
+    app.config.from_mapping(env_config())
+    app.config.from_mapping(config or {})
+    app.config["SESSION_PERMANENT"] = False
+
+    # Check for required settings
+    if not app.config["DATABASE_URL"]:
+        raise RuntimeError("DATABASE_URL is not set")
+
+    if not app.config["API_KEY"]:
+        raise RuntimeError("API_KEY is not set")
+
+    components = Components(app)
+    app.extensions["readrate"] = components
+
+    components.assets.init_app(app)
+
+    # Configure sessions - a signed cookie by default, or a store shared by all app nodes (its engine is created on first use):
+    init_sessions(app, LocalProxy(lambda: components.database.primary), app.config["SESSION_BACKEND"])
+
+    app.register_blueprint(views)
+
+    for endpoint in CACHED_PAGES:
+        app.view_functions[endpoint] = components.page_cache.page(app.view_functions[endpoint])
+
+    # Record request latency, SQL, HTTP and template times, served on /metrics:
+    metrics = components.metrics
+    metrics.init_app(app)
+    components.database.on_engine(metrics.instrument)
+    metrics.add_collector("password_hasher", components.password_hasher.stats)
+    metrics.add_collector("rating_cache", components.rating_cache.stats)
+    metrics.add_collector("page_cache", components.page_cache.stats)
+    metrics.add_collector("covers", components.cover_store.stats)
+    for name in components.database.pool_names():
+        metrics.add_collector(f"db_pool_{name}", lambda name=name: components.database.pool_stats(name))
 
-from helpers import add_star_img, validate_pass, form_time, get_rating
+    if app.config["PRELOAD"]:
+        preload(app)
 
-app = Flask(__name__, static_folder='static')
+    return app
 
-# Check for environment variables
-if not os.getenv("DATABASE_URL"):
-    raise RuntimeError("DATABASE_URL is not set")
 
-if not os.getenv("API_KEY"):
-    raise RuntimeError("API_KEY is not set")
+def preload(app):
+    """
+    Load what every request needs up front - the templates, the GoodReads
+    scraper and the home page's book pools. A pre-forking server (e.g.
+    PRELOAD=1 gunicorn --preload "application:create_app()") runs this once
+    before forking, so workers share the loaded state instead of each paying
+    for it on its first requests. Database connections used to load it are
+    closed again, so no two workers share one.
+    """
+
+    # Loaded here, rather than by the first request needing a rating to be scraped:
+    import goodreads
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    components = app.extensions["readrate"]
+
+    with app.app_context():
+        components.book_sampler.load()
+        components.db.remove()
+
+    components.database.dispose()
+
+
+# Ratings and dates are formatted as templates render them:
+views.add_app_template_filter(star_img)
+views.add_app_template_filter(review_date)
+
 
-# Configure session to use filesystem
-app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+@views.app_template_filter()
+def book_card(book):
+    """Render a book's card, reusing the cached card until the book's details or ratings change"""
+    return page_cache.fragment(("book_card", book), [f"book:{book.id}"],
+                               lambda: Markup(current_app.jinja_env.get_template("book_card.html").render(book=book)))
 
-# Set up database
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
 
+@views.before_app_request
+def route_reads():
+    """Send read-only routes' queries to a replica, unless the user has just written"""
+    if request.endpoint in READ_ONLY_ROUTES and session.get("primary_until", 0) < time.time():
+        database.read_from_replica()
 
-@app.route("/")
+
+def read_your_writes():
+    """Read from the primary for READ_YOUR_WRITES_SECONDS, after a change the user expects to see, while the replicas catch up"""
+    if database.replica_urls:
+        session["primary_until"] = time.time() + current_app.config["READ_YOUR_WRITES_SECONDS"]
+
+
+@views.teardown_app_request
+def remove_session(exception=None):
+    """Return the request's database connection to the pool"""
+    db.remove()
+
+
+@views.route("/")
 def index():
     """ Home Page of the Application """
 
-    # Top Rated Books - select 6 highest rated books:
-    top = db.execute("SELECT * FROM books WHERE average_rating >= 4.5 ORDER BY RANDOM() LIMIT 6").fetchall()
-
-    top = add_star_img(top)
+    # Top Rated Books - select 6 random books from the highest rated:
+    top = book_sampler.top_rated(6)
 
     # Lucky Dip Section - select 6 random books:
-    lucky = db.execute("SELECT * FROM books ORDER BY RANDOM() LIMIT 6").fetchall()
-
-    lucky = add_star_img(lucky)
+    lucky = book_sampler.lucky_dip(6)
 
     # Author Explore Section - select up to 6 books from an author:
-    author = db.execute("SELECT * FROM books WHERE author in (SELECT author FROM books GROUP BY author ORDER BY RANDOM() LIMIT 1) LIMIT 6").fetchall()
-
-    author = add_star_img(author)
+    author = book_sampler.author_books(6)
 
     return render_template("home.html", top=top, lucky=lucky, author=author)
 
 
-@app.route("/login", methods=["GET", "POST"])
+@views.route("/login", methods=["GET", "POST"])
 def login():
     """Log user into site"""
 
@@ -75,16 +316,23 @@ def login():
             return render_template("login.html")
 
         # Query database for username:
-        user = db.execute("SELECT * FROM users WHERE username = :username", {"username" : username}).fetchone()
+        user = queries.find_user(db, username)
 
         # Check username exists and password is correct:
-        if not user or not check_password_hash(user[2], password):
+        matches, new_hash = password_hasher.verify(user.hash, password) if user else (False, None)
+
+        if not matches:
             flash("Invalid username and/or password! Please try again!")
             return render_template("login.html")
 
+        # Upgrade password hashes made with outdated parameters:
+        if new_hash:
+            queries.set_password_hash(db, user.id, new_hash)
+            db.commit()
+
         # Otherwise log in user and redirect to homepage:
-        session["user_id"] = user[0]
-        session["username"] = user[1]
+        session["user_id"] = user.id
+        session["username"] = user.username
 
         flash('Log in Successful! Welcome back to READ-RATE!')
         return redirect("/")
@@ -94,7 +342,7 @@ def login():
         return render_template("login.html")
 
 
-@app.route("/register", methods=["GET", "POST"])
+@views.route("/register", methods=["GET", "POST"])
 def register():
     """Register user for the website"""
 
@@ -128,24 +376,21 @@ def register():
         # Otherwise information from registration is complete:
         else:
             # Check username does not already exist, if it does then ask for a different name:
-            if db.execute("SELECT * FROM users WHERE username = :username", {"username" : username}).fetchone():
+            if queries.username_exists(db, username):
                 flash('Sorry but that username is already in use, please pick a different username!')
                 return render_template("register.html")
 
             # Otherwise add user to database using hashed password:
-            hash_pass = generate_password_hash(password)
+            hash_pass = password_hasher.hash(password)
 
             # Add new user to users table:
-            db.execute("INSERT INTO users (username, hash) VALUES(:username, :hash)", {"username" : username, "hash" : hash_pass})
+            user_id = queries.add_user(db, username, hash_pass)
 
             db.commit()
 
             # Put unique user ID and username into session:
-
-            user_info = db.execute("SELECT id, username FROM users WHERE username=:username", {"username" : username}).fetchall()
-
-            session["user_id"] = user_info[0][0]
-            session["username"] = user_info[0][1]
+            session["user_id"] = user_id
+            session["username"] = username
 
             # Return to home page, logged in:
             flash('Welcome to READ-RATE! You have been succesfully registered and logged in!')
@@ -156,7 +401,7 @@ def register():
         return render_template("register.html")
 
 
-@app.route("/logout")
+@views.route("/logout")
 def logout():
     """Log user out"""
 
@@ -172,71 +417,87 @@ def logout():
     return redirect("/")
 
 
-@app.route("/author_details/<name>")
+@views.route("/author_details/<name>")
 def author_details(name):
     """Display all books by a given author"""
 
-    # Author Explore Section - select up to 4 books from an author:
-    author = db.execute("SELECT * FROM books WHERE author=:author", {"author":name}).fetchall()
+    # Get a page of books by the author, in title order:
+    direction, cursor, size = page_request(request.args, 24, 96, text_key)
+    author = queries.author_books_page(db, name, direction, cursor, size)
 
     # If author does not exist then return home with apology:
-    if not author:
+    if not author and not direction:
         flash("Sorry but that author could not be found in the READ-RATE database!")
         return redirect("/")
 
-    author = add_star_img(author)
+    author, next_page, prev_page = page_cursors(author, direction, size, lambda book: [book.title, book.id])
 
-    return render_template("author_details.html", author=author, lucky=author)
+    return render_template("author_details.html", name=name, author=author, lucky=author, next_page=next_page, prev_page=prev_page)
 
 
-@app.route("/book_details/<book_id>")
+@views.route("/book_details/<book_id>")
 def book_details(book_id):
     """Display a single book's details and its review page"""
 
-    user_review = None
+    # Start getting a page of Reviews and reviewer details for the Book, newest first, and the user's own review if they are logged in,
+    # on separate connections while the book itself is fetched:
+    direction, cursor, size = page_request(request.args, 20, 100, date_key)
+    reviews = query_pool.submit(queries.book_reviews_page, book_id, direction, cursor, size)
+    user_review = query_pool.submit(queries.get_own_review, session["user_id"], book_id) if session.get("user_id") else None
 
     # Get Book Details:
-    book = db.execute("SELECT * FROM books WHERE id=:id", {"id": book_id}).fetchall()
+    book = queries.get_book(db, book_id)
 
     # If book is not in database, return to homepage with apology:
     if not book:
         flash("Sorry, this book ID does not exist in the READ-RATE database!")
         return redirect("/")
 
-    book = add_star_img(book)
-
-    # Get All Reviews and reviewer details for the Book:
-    reviews = db.execute("SELECT users.id, users.username, reviews.text, reviews.date, reviews.rating FROM users INNER JOIN reviews ON users.id=reviews.user_id WHERE reviews.book_id=:book_id ORDER BY reviews.date DESC", {"book_id": book_id}).fetchall()
-
-    reviews = add_star_img(reviews)
-    reviews = form_time(reviews)
+    page_cache.tag(f"book:{book.id}")
 
     """
     # GoodReads API no longer available - Now switched to scraping the Goodreads website
     # Get Additional Reviews and ratings from GoodReads API:
     try:
-      gr_res = requests.get("https://www.goodreads.com/book/review_counts.json", params={"key": os.getenv("API_KEY"), "isbns": book[0][1]}).json()['books'][0]
+      gr_res = requests.get("https://www.goodreads.com/book/review_counts.json", params={"key": os.getenv("API_KEY"), "isbns": book.isbn}).json()['books'][0]
     except json.decoder.JSONDecodeError:
       flash("Error with GoodReads API!")
       return redirect("/")
 
     good_reads = (gr_res['average_rating'], gr_res['work_ratings_count'])
     """
-    print(book, book[0][1], type(book[0][1]))
-    # Scrape GoodReads website for additional reviews/ratings:
-    good_reads = get_rating(book[0][1])
+    # Get additional reviews/ratings scraped from the GoodReads website, as soon as the ISBN is known:
+    try:
+        good_reads = rating_pool.submit(lambda session, isbn: rating_cache.get(isbn), book.isbn)
+    except QueryPoolFull:
+        good_reads = None
+    rating_deadline = time.monotonic() + current_app.config["RATING_DEADLINE"]
+
+    # Queries still waiting for a busy pool's workers are run here instead:
+    wait, timeout = current_app.config["QUERY_WAIT"], current_app.config["QUERY_TIMEOUT"]
+    try:
+        reviews_page = query_pool.result(reviews, wait, timeout)
+        user_review = user_review and query_pool.result(user_review, wait, timeout)
+    except FutureTimeout:
+        # The database is too slow to show the page - drop the queries not yet started, the GoodReads rating is still cached when it arrives:
+        for future in (reviews, user_review):
+            if future:
+                future.cancel()
+        flash("READ-RATE is very busy right now! Please try again in a moment.")
+        return redirect("/")
 
-    # If a user is logged in, check if they have left their own review:
-    if session.get("user_id"):
-        user_review = db.execute("SELECT id, user_id, text, date, rating FROM reviews WHERE user_id=:user_id AND book_id=:book_id", {"user_id": session["user_id"], "book_id": book_id}).fetchall()
+    reviews, next_page, prev_page = page_cursors(reviews_page, direction, size, lambda review: [review.date, review.id])
 
-        user_review = add_star_img(user_review)
-        user_review = form_time(user_review)
+    # Don't hold up the page for a slow GoodReads - show N/A, the rating is cached when it arrives:
+    try:
+        good_reads = good_reads.result(timeout=max(0, rating_deadline - time.monotonic())) if good_reads else NO_RATING
+    except FutureTimeout:
+        good_reads = NO_RATING
 
-    return render_template("book_details.html", book=book, reviews=reviews, good_reads=good_reads, user_review=user_review)
+    return render_template("book_details.html", book=book, reviews=reviews, good_reads=good_reads, user_review=user_review, next_page=next_page, prev_page=prev_page)
 
 
-@app.route("/review/<book_id>", methods=["POST"])
+@views.route("/review/<book_id>", methods=["POST"])
 def add_review(book_id):
     """ Adds a user's book review to the database """
 
@@ -262,32 +523,26 @@ def add_review(book_id):
         return redirect(f"/book_details/{book_id}")
 
     # Check the user has not already reviewed this book:
-    if db.execute("SELECT * FROM reviews WHERE user_id=:user_id AND book_id=:book_id", {"user_id": session["user_id"], "book_id": book_id}).fetchone():
+    if queries.has_reviewed(db, session["user_id"], book_id):
         flash("You have already reviewed this book - please edit your current review instead!")
         return redirect(f"/book_details/{book_id}")
 
-    # Otherwise add the review to database, update the book's score and return to the book page:
-    db.execute("INSERT INTO reviews (user_id, book_id, text, rating, date) VALUES(:user_id, :book_id, :text, :rating, CURRENT_TIMESTAMP(0))", {"user_id": session["user_id"], "book_id": book_id, "text": review_text, "rating": review_score})
-
-    # Update books table with review count and avg review score:
-    book_reviews = db.execute("SELECT COUNT(*), AVG(rating) FROM reviews WHERE book_id=:book_id", {"book_id": book_id}).fetchall()
-
-    num_reviews = book_reviews[0][0]
-    avg_review = round(float(book_reviews[0][1]),2)
-
-    db.execute("UPDATE books SET review_count=:review_count, average_rating=:average_rating WHERE id=:book_id", {"review_count": num_reviews, "average_rating": avg_review, "book_id": book_id})
-
-    # Update a user's number of reviews:
-    db.execute("UPDATE users SET num_reviews = num_reviews + 1 WHERE id=:id", {"id": session["user_id"]})
+    # Otherwise add the review to database, update the book's score and the user's number of reviews, and return to the book page:
+    queries.add_review(db, session["user_id"], book_id, review_text, review_score)
 
     db.commit()
+    read_your_writes()
+
+    # Book ratings have changed, so drop the book's cached pages and cards and reload the top rated book ids:
+    page_cache.invalidate(f"book:{int(book_id)}")
+    book_sampler.invalidate_ratings()
 
     # Return to book details page:
     flash("Thank you for your review! It has been added to the READ-RATE database.")
     return redirect(f"/book_details/{book_id}")
 
 
-@app.route("/edit_review/<book_id>", methods=["POST"])
+@views.route("/edit_review/<book_id>", methods=["POST"])
 def edit_review(book_id):
     """ Edit a user's book review in the database """
 
@@ -313,29 +568,26 @@ def edit_review(book_id):
         return redirect(f"/book_details/{book_id}")
 
     # Check the user has already reviewed this book:
-    if not db.execute("SELECT * FROM reviews WHERE user_id=:user_id AND book_id=:book_id", {"user_id": session["user_id"], "book_id": book_id}).fetchone():
+    if not queries.has_reviewed(db, session["user_id"], book_id):
         flash("You not yet reviewed this book - please submit a review instead!")
         return redirect(f"/book_details/{book_id}")
 
     # Otherwise update the review in the database, update the book's score and return to the book page:
-    db.execute("UPDATE reviews SET text=:text, rating=:rating, date=CURRENT_TIMESTAMP(0) WHERE user_id=:user_id AND book_id=:book_id", {"user_id": session["user_id"], "book_id": book_id, "text": review_text, "rating": review_score})
-
-    # Update books table with review count and avg review score:
-    book_reviews = db.execute("SELECT COUNT(*), AVG(rating) FROM reviews WHERE book_id=:book_id", {"book_id": book_id}).fetchall()
-
-    num_reviews = book_reviews[0][0]
-    avg_review = round(float(book_reviews[0][1]),2)
-
-    db.execute("UPDATE books SET review_count=:review_count, average_rating=:average_rating WHERE id=:book_id", {"review_count": num_reviews, "average_rating": avg_review, "book_id": book_id})
+    queries.edit_review(db, session["user_id"], book_id, review_text, review_score)
 
     db.commit()
+    read_your_writes()
+
+    # Book ratings have changed, so drop the book's cached pages and cards and reload the top rated book ids:
+    page_cache.invalidate(f"book:{int(book_id)}")
+    book_sampler.invalidate_ratings()
 
     # Return to book details page:
     flash("Your review has been updated!")
     return redirect(f"/book_details/{book_id}")
 
 
-@app.route("/delete/<book_id>", methods=["POST"])
+@views.route("/delete/<book_id>", methods=["POST"])
 def delete_review(book_id):
     """ Delete a user's Review From the Database"""
 
@@ -344,88 +596,75 @@ def delete_review(book_id):
         flash("You must be logged in to delete a review!")
         return redirect(f"/book_details/{book_id}")
 
-    # Remove user's review for the book from the database:
-    db.execute("DELETE FROM reviews WHERE user_id=:user_id AND book_id=:book_id" , {"user_id": session["user_id"], "book_id": book_id})
-
-    # Update books table with review count and avg review score:
-    book_reviews = db.execute("SELECT COUNT(*), AVG(rating) FROM reviews WHERE book_id=:book_id", {"book_id": book_id}).fetchall()
-
-    num_reviews = book_reviews[0][0]
-    avg_review = round(float(book_reviews[0][1]),2)
-
-    db.execute("UPDATE books SET review_count=:review_count, average_rating=:average_rating WHERE id=:book_id", {"review_count": num_reviews, "average_rating": avg_review, "book_id": book_id})
-
-    # Update a user's number of reviews:
-    db.execute("UPDATE users SET num_reviews = num_reviews - 1 WHERE id=:id", {"id": session["user_id"]})
+    # Remove user's review for the book from the database, taking it off the book's score and the user's number of reviews:
+    queries.delete_review(db, session["user_id"], book_id)
 
     db.commit()
+    read_your_writes()
+
+    # Book ratings have changed, so drop the book's cached pages and cards and reload the top rated book ids:
+    page_cache.invalidate(f"book:{int(book_id)}")
+    book_sampler.invalidate_ratings()
 
     # Return to book details page:
     flash("Your review has been removed!")
     return redirect(f"/book_details/{book_id}")
 
 
-@app.route("/user_details/<user_id>")
+@views.route("/user_details/<user_id>")
 def user_details(user_id):
     """Display all the reviews written by a single user"""
 
     # Get the username of the user:
-    username = db.execute("SELECT username FROM users WHERE id=:user_id", {"user_id": user_id}).fetchone()
+    username = queries.get_username(db, user_id)
 
     # If username does not exist return to homepage with apology:
     if not username:
         flash("Sorry but this user does not exist!")
         return redirect("/")
 
-    # Get all reviews by the user reviewer details for the Book:
-    reviews = db.execute("SELECT users.username, books.id, books.isbn, reviews.date, books.title, books.author, reviews.text, reviews.rating FROM users INNER JOIN reviews ON users.id=reviews.user_id INNER JOIN books ON reviews.book_id = books.id WHERE users.id=:user_id ORDER BY reviews.date DESC", {"user_id": user_id}).fetchall()
+    # Get a page of reviews by the user and details of the reviewed Books, newest first:
+    direction, cursor, size = page_request(request.args, 20, 100, date_key)
+    reviews = queries.user_reviews_page(db, user_id, direction, cursor, size)
 
-    reviews = add_star_img(reviews)
-    reviews = form_time(reviews)
+    reviews, next_page, prev_page = page_cursors(reviews, direction, size, lambda review: [review.date, review.id])
 
-    return render_template("user_details.html", username=username, reviews=reviews)
+    return render_template("user_details.html", username=username, reviews=reviews, next_page=next_page, prev_page=prev_page)
 
 
-@app.route("/search", methods=["POST"])
+@views.route("/search", methods=["POST"])
 def search():
     """ Get results for a title, author or ISBN search """
 
     # Get input from search bar
     search_type = request.form.get("search-type")
     search = request.form.get("search-text")
-    search_text = '%' + search + '%'
 
     # If a search parameter is missing, render homepage with an apology
-    if not search_type or not search_text:
+    if not search_type or not search:
         flash('Please select search type and enter a search value to search for books!')
         return redirect("/")
 
+    # Only search the title, author and isbn columns:
+    if search_type not in SEARCH_FIELDS:
+        flash('Please search for books by title, author or ISBN!')
+        return redirect("/")
+
     # Otherwise check the search term and generate a query result:
     author = None
     title_isbn = None
 
     if search_type == 'author':
-        author = []
-        # Get 10 authors:
-        author_names = db.execute("SELECT author FROM books WHERE author ILIKE :search_text GROUP BY author LIMIT 10", {"search_text" : search_text}).fetchall()
-
-        # For each author in list, get 6 books:
-        for name in author_names:
-            author_books = db.execute("SELECT * FROM books WHERE author = :author LIMIT 6", {"author" : name[0]}).fetchall()
-
-            author_books = add_star_img(author_books)
-
-            author.append(author_books)
+        # Get 10 authors, with 6 books for each:
+        author = search_author_books(db, search, 10, 6)
 
     else:
         # Get similar books by isbn or book title
-        title_isbn = db.execute(f"SELECT * FROM books WHERE {search_type} ILIKE :search_text LIMIT 30", {"search_text" : search_text}).fetchall()
-
-        title_isbn = add_star_img(title_isbn)
+        title_isbn = search_books(db, search_type, search, 30)
 
     return render_template("/search_results.html", search_type=search_type, search_text=search, author=author, title_isbn=title_isbn)
 
-@app.route("/recommended")
+@views.route("/recommended")
 def recommended():
     """ Gets some simple book recommendations for a user based on their reviews """
 
@@ -435,26 +674,18 @@ def recommended():
         return redirect("/")
 
     author_rec = None
-    books_rec = None
 
     # Pick a book that the user has reviewed 4-5 stars, and if the author has some other books, recommend up to 6 of them to the user:
 
-    author_rec = db.execute("SELECT * FROM books WHERE author IN (SELECT books.author FROM books INNER JOIN reviews ON books.id=reviews.book_id WHERE reviews.user_id=:user_id AND reviews.rating >= 4 ORDER BY RANDOM() LIMIT 1) AND id NOT IN (SELECT book_id FROM reviews WHERE user_id=:user_id) ORDER BY RANDOM() LIMIT 6", {"user_id": session["user_id"]}).fetchall()
-
-    author_rec = add_star_img(author_rec)
-
-    # Pick a book that the user has reviewed highly, find users that also reviewed this book highly, and find other books they enjoyed:
-    hr_book = db.execute("SELECT books.id, books.title, books.author FROM books INNER JOIN reviews ON books.id=reviews.book_id WHERE reviews.user_id=:user_id AND reviews.rating >= 4 ORDER BY RANDOM() LIMIT 1", {"user_id": session["user_id"]}).fetchone()
+    author_rec = queries.author_recommendations(db, session["user_id"], 6)
 
-    if hr_book:
-        books_rec = db.execute("SELECT * FROM books WHERE id IN (SELECT book_id FROM reviews WHERE user_id IN (SELECT user_id FROM reviews WHERE book_id=:book_id AND rating >=4 AND user_id!=:user_id) AND book_id!=:book_id GROUP BY book_id ORDER BY AVG(rating) DESC LIMIT 6)", {"book_id": hr_book[0], "user_id": session["user_id"]}).fetchall()
+    # Find books most similar to all of the books the user has reviewed highly, from the precomputed book neighbours:
+    books_rec = recommend(db, session["user_id"], 6)
 
-        books_rec = add_star_img(books_rec)
+    return render_template("recommended.html", author_rec=author_rec, books_rec=books_rec)
 
-    return render_template("recommended.html", author_rec=author_rec, hr_book=hr_book, books_rec=books_rec)
 
-
-@app.route("/account", methods=["GET", "POST"])
+@views.route("/account", methods=["GET", "POST"])
 def account():
     """Let users change account password and delete their account"""
 
@@ -477,9 +708,9 @@ def account():
             return render_template("account.html")
 
         # Get current password hash to check it matches:
-        logged_pass = db.execute("SELECT hash FROM users WHERE id=:id", {"id": session["user_id"]}).fetchone()[0]
+        logged_pass = queries.get_password_hash(db, session["user_id"])
 
-        if not check_password_hash(logged_pass, curr_pass):
+        if not password_hasher.verify(logged_pass, curr_pass, rehash=False)[0]:
             flash("Incorrect current password entered, please try again!")
             return render_template("account.html")
 
@@ -489,8 +720,8 @@ def account():
             return render_template("account.html")
 
         # Otherwise generate new password hash and update the password hash in DBfor this user:
-        new_pass_hash = generate_password_hash(new_pass)
-        db.execute("UPDATE users SET hash = :new_pass_hash WHERE id = :id", {"new_pass_hash": new_pass_hash, "id": session["user_id"]})
+        new_pass_hash = password_hasher.hash(new_pass)
+        queries.set_password_hash(db, session["user_id"], new_pass_hash)
 
         db.commit()
 
@@ -502,7 +733,7 @@ def account():
         return render_template("account.html")
 
 
-@app.route("/delete_account", methods=["POST"])
+@views.route("/delete_account", methods=["POST"])
 def delete_account():
     """Deletes a users account and all their reviews from the database"""
 
@@ -514,60 +745,145 @@ def delete_account():
     # Check user has input their password correctly:
     del_pass = request.form.get("del-pass")
 
-    logged_pass = db.execute("SELECT hash FROM users WHERE id=:id", {"id": session["user_id"]}).fetchone()[0]
+    logged_pass = queries.get_password_hash(db, session["user_id"])
 
-    if not check_password_hash(logged_pass, del_pass):
+    if not password_hasher.verify(logged_pass, del_pass, rehash=False)[0]:
         flash("Incorrect password entered for account deletion. Please try again.")
         return render_template("account.html")
 
-    # Get all of a user's reviews from the database:
-    book_ids = db.execute("SELECT book_id FROM reviews WHERE user_id=:user_id", {"user_id": session["user_id"]}).fetchall()
-
-    # Delete all of the user's reviews:
-    db.execute("DELETE FROM reviews WHERE user_id=:user_id", {"user_id": session["user_id"]})
-
-    # Update all of the book avg scores in books table that have had reviews deleted:
-    for book_id in book_ids:
-        book_reviews = db.execute("SELECT COUNT(*), AVG(rating) FROM reviews WHERE book_id=:book_id", {"book_id": book_id[0]}).fetchall()
-
-        num_reviews = book_reviews[0][0] or 0
-        avg_review = round(float(book_reviews[0][1] or 0),2)
-
-        db.execute("UPDATE books SET review_count=:review_count, average_rating=:average_rating WHERE id=:book_id", {"review_count": num_reviews, "average_rating": avg_review, "book_id": book_id[0]})
-
-    # Remove the user from the user's table:
-    db.execute("DELETE FROM users WHERE id=:user_id", {"user_id": session["user_id"]})
+    # Delete all of the user's reviews, taking them off the scores of the books they reviewed, and remove the user from the users table:
+    reviewed = queries.delete_user(db, session["user_id"])
     db.commit()
 
+    # Book ratings have changed, so drop the books' cached pages and cards and reload the top rated book ids:
+    page_cache.invalidate(*(f"book:{book_id}" for book_id in reviewed))
+    book_sampler.invalidate_ratings()
+
     # Log out user and return to homepage:
     session.clear()
     flash("Your account has been deleted and you have been logged out. Thank you for using READ-RATE!")
     return redirect("/")
 
-@app.route("/api/<isbn>")
+def book_json(book):
+    """Formats a book row from the database as an API JSON object"""
+
+    return {
+        "title": book.title,
+        "author": book.author,
+        "year": book.year,
+        "isbn": book.isbn,
+        "review_count": book.review_count,
+        "average_score": float(book.average_rating)
+    }
+
+
+def book_etag(book):
+    """
+    ETag for a book row - it changes whenever a review of the book is added,
+    edited or deleted, as that changes the book's review aggregates, and
+    whenever an import changes the book's details
+    """
+
+    return f"{book.id}-{book.review_count}-{book.rating_total}-{int(book.reviews_updated.timestamp())}-{int(book.updated_at.timestamp())}"
+
+
+def book_modified(book):
+    """When a book row last changed, for its Last-Modified header"""
+
+    return max(book.reviews_updated, book.updated_at)
+
+
+def conditional_json(data, etag, last_modified):
+    """
+    JSON response with cache headers, answered with 304 Not Modified if the
+    request's If-None-Match or If-Modified-Since show the client has it already
+    """
+
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = API_MAX_AGE
+
+    return response.make_conditional(request)
+
+
+@views.route("/api/<isbn>")
 def book_api(isbn):
     """Get a book from the database using its ISBN"""
 
     # Try and get book from the database:
-    book = db.execute(('SELECT * '
-                       'FROM books '
-                       'WHERE isbn = :isbn'), {"isbn":isbn}).fetchall()
-
-    # If book exists, return JSON:
-    if book:
-        return jsonify({
-            "title": book[0][2],
-            "author": book[0][3],
-            "year": book[0][4],
-            "isbn": book[0][1],
-            "review_count": book[0][5],
-            "average_score": book[0][6]
-        })
+    book = queries.get_api_book(db, isbn)
+
     # If book not in database, return error:
-    else:
+    if not book:
         return jsonify({"error": "Book ISBN is not in READ-RATE Database"}), 404
 
-    return book[0][2]
+    return conditional_json(book_json(book), book_etag(book), book_modified(book))
+
+
+@views.route("/api/books")
+def books_api():
+    """
+    Get up to API_BATCH_SIZE books from the database in one request, using
+    their ISBNs - given as repeated or comma separated isbn arguments
+    """
+
+    # Get the requested ISBNs in order, without duplicates:
+    isbns = list(dict.fromkeys(isbn.strip() for arg in request.args.getlist("isbn") for isbn in arg.split(",") if isbn.strip()))
+
+    if not isbns:
+        return jsonify({"error": "No ISBNs given - use ?isbn=<isbn>,<isbn>..."}), 400
+
+    if len(isbns) > API_BATCH_SIZE:
+        return jsonify({"error": f"Too many ISBNs - at most {API_BATCH_SIZE} can be looked up at once"}), 400
+
+    # Get all of the books in a single query:
+    books = queries.get_api_books(db, isbns)
+
+    found = dict((book.isbn, book) for book in books)
+    missing = [isbn for isbn in isbns if isbn not in found]
+
+    # The batch ETag changes if any of the books' ETags do:
+    etag = hashlib.md5(" ".join([book_etag(book) for book in books] + missing).encode()).hexdigest()
+    last_modified = max((book_modified(book) for book in books), default=None)
+
+    data = {
+        "books": dict((isbn, book_json(found[isbn])) for isbn in isbns if isbn in found),
+        "missing": missing
+    }
+
+    return conditional_json(data, etag, last_modified)
+
+
+@views.route("/api/<isbn>/reviews")
+def book_reviews_api(isbn):
+    """Get a page of a book's reviews, newest first, using its ISBN"""
+
+    # Try and get book from the database:
+    book_id = queries.get_book_id(db, isbn)
+
+    # If book not in database, return error:
+    if not book_id:
+        return jsonify({"error": "Book ISBN is not in READ-RATE Database"}), 404
+
+    direction, cursor, size = page_request(request.args, 20, 100, date_key)
+
+    reviews = queries.api_reviews_page(db, book_id, direction, cursor, size)
+
+    reviews, next_page, prev_page = page_cursors(reviews, direction, size, lambda review: [review.date, review.id])
+
+    return jsonify({
+        "isbn": isbn,
+        "reviews": [{
+            "username": review.username,
+            "date": review.date.isoformat(),
+            "text": review.text,
+            "rating": review.rating
+        } for review in reviews],
+        "next": next_page,
+        "prev": prev_page
+    })
 
 
 # Error Handler:
@@ -579,12 +895,42 @@ def errorhandler(e):
     return redirect("/")
 
 
+@views.app_errorhandler(HasherBusy)
+def hasher_busy(e):
+    """Send the user back to the form they submitted when password hashing is saturated"""
+    flash("READ-RATE is very busy right now! Please try again in a moment.")
+    return redirect(request.referrer or "/")
+
+
+@views.route("/cover/<isbn>/<size>")
+def cover(isbn, size):
+    """Serve a book's cover thumbnail (size S or L), or the default cover if it has none"""
+
+    try:
+        found = cover_store.get(isbn, size)
+    except ValueError:
+        return jsonify({"error": "No such cover"}), 404
+
+    # A book's cover doesn't change, so browsers and CDNs can keep it for good:
+    if found:
+        path, digest = found
+        response = send_file(path, mimetype="image/jpeg", add_etags=False)
+        response.set_etag(digest)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response.make_conditional(request)
+
+    # Books without a cover may gain one, so the default is only kept for a day:
+    response = send_file(os.path.join(current_app.static_folder, "default_cover.jpg"), mimetype="image/jpeg", conditional=True)
+    response.headers["Cache-Control"] = "public, max-age=86400"
+    return response
+
+
 # Handle static files from root:
-@app.route('/robots.txt')
+@views.route('/robots.txt')
 def static_from_root():
-    return send_from_directory(app.static_folder, request.path[1:])
+    return send_from_directory(current_app.static_folder, request.path[1:])
 
 
 # Listen for errors
 for code in default_exceptions:
-    app.errorhandler(code)(errorhandler)
+    views.app_errorhandler(code)(errorhandler)
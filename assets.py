@@ -0,0 +1,229 @@
+"""
+Fingerprinted, precompressed static files for READ-RATE.
+
+The build copies every file in static/ to static/dist/ under a name that
+includes a hash of its contents (styles.css -> styles.1a2b3c4d5e.css),
+writes gzip and, if the brotli package is installed, brotli compressed
+copies of text files next to them, and lists the names in
+static/dist/manifest.json:
+
+    python3 assets.py
+
+Once the manifest exists, url_for('static', filename='styles.css') gives the
+fingerprinted URL, and those files are served compressed to browsers that
+accept it and cached for good - a changed file gets a new name. Without a
+build, static files are served from static/ as usual.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory
+
+BUILD_DIR = "dist"
+MANIFEST = "manifest.json"
+
+# Sources and leftovers that pages never load:
+SKIP_EXTENSIONS = (".scss",)
+
+# Files worth compressing - images and fonts are compressed already:
+COMPRESS_EXTENSIONS = (".css", ".js", ".map", ".svg", ".txt", ".webmanifest", ".ico", ".json")
+
+# Smaller files aren't worth the extra request header and decompression:
+MIN_COMPRESS_BYTES = 256
+
+# Encodings in order of preference, with the extension of their precompressed files:
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# References to other static files in CSS, rewritten to their fingerprinted names:
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)|(sourceMappingURL=)(\S+)""")
+
+# Seconds browsers and CDNs may keep fingerprinted files - a year, as a changed file gets a new name:
+MAX_AGE = 31536000
+
+# Not in every system's mime.types:
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+def fingerprint(name, content):
+    """Return name with a hash of content before its extension"""
+
+    root, extension = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{extension}"
+
+
+def compress(path, content):
+    """Write the gzip and brotli (if available) versions of a file, if they are smaller, returns the encodings written"""
+
+    written = []
+
+    # Fixed mtime, so unchanged files give identical archives:
+    versions = [("gzip", ".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    if brotli is not None:
+        versions.append(("br", ".br", brotli.compress(content, quality=11)))
+
+    for encoding, extension, compressed in versions:
+        if len(compressed) < len(content):
+            with open(path + extension, "wb") as f:
+                f.write(compressed)
+            written.append(encoding)
+
+    return written
+
+
+def build(static_dir):
+    """Build static_dir/dist from static_dir, returns the manifest"""
+
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+
+    sources = []
+    for directory, subdirectories, filenames in os.walk(static_dir):
+        if os.path.abspath(directory) == os.path.abspath(build_dir):
+            subdirectories[:] = []
+            continue
+        for filename in filenames:
+            if not filename.endswith(SKIP_EXTENSIONS):
+                sources.append(os.path.relpath(os.path.join(directory, filename), static_dir).replace(os.sep, "/"))
+
+    # CSS refers to the other files, so it goes last, once their names are known:
+    sources.sort(key=lambda name: (name.endswith(".css"), name))
+
+    files = {}
+    compressed = {}
+
+    for name in sources:
+        with open(os.path.join(static_dir, name), "rb") as f:
+            content = f.read()
+
+        if name.endswith(".css"):
+            content = rewrite_css(name, content.decode(), files).encode()
+
+        files[name] = fingerprint(name, content)
+
+        path = os.path.join(build_dir, files[name])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+        if name.endswith(COMPRESS_EXTENSIONS) and len(content) >= MIN_COMPRESS_BYTES:
+            encodings = compress(path, content)
+            if encodings:
+                compressed[files[name]] = encodings
+
+    manifest = {"files": files, "compressed": compressed}
+
+    with open(os.path.join(build_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def rewrite_css(name, css, files):
+    """Replace relative references in a stylesheet with the fingerprinted names of the files they point to"""
+
+    directory = os.path.dirname(name)
+
+    def replace(match):
+        quote, target, suffix, source_map, map_target = match.groups()
+        reference = target if source_map is None else map_target
+
+        resolved = os.path.normpath(os.path.join(directory, reference)).replace(os.sep, "/")
+        if resolved not in files or reference.startswith(("/", "data:")) or "://" in reference:
+            return match.group(0)
+
+        renamed = os.path.relpath(files[resolved], directory or ".").replace(os.sep, "/")
+
+        if source_map is not None:
+            return source_map + renamed
+        return f"url({quote}{renamed}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, css)
+
+
+class Assets:
+    """
+    Points url_for('static', ...) at the fingerprinted files listed in the
+    build manifest, and serves them, precompressed where possible, with
+    headers letting browsers and CDNs cache them for good
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.compressed = {}
+        self.outputs = set()
+
+    def init_app(self, app):
+        self.build_dir = os.path.join(app.static_folder, BUILD_DIR)
+
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            app.logger.info("No static asset manifest, run assets.py to fingerprint and compress static files")
+            manifest = {}
+
+        self.files = manifest.get("files", {})
+        self.compressed = manifest.get("compressed", {})
+        self.outputs = set(self.files.values())
+
+        app.url_defaults(self.fingerprinted_url)
+        app.view_functions["static"] = self.send_static
+
+    def fingerprinted_url(self, endpoint, values):
+        """url_for defaults hook: swap static file names for their fingerprinted names from the manifest"""
+
+        if endpoint == "static":
+            filename = values.get("filename")
+            if filename in self.files:
+                values["filename"] = f"{BUILD_DIR}/{self.files[filename]}"
+
+    def send_static(self, filename):
+        """Static file view, serving fingerprinted files with long lived cache headers and precompressed if accepted"""
+
+        prefix = BUILD_DIR + "/"
+        name = filename[len(prefix):] if filename.startswith(prefix) else None
+
+        if name not in self.outputs:
+            # Not a build output: a plain static file, or a name from an old build, which must not be cached for good:
+            return send_from_directory(os.path.dirname(self.build_dir), filename)
+
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        encodings = self.compressed.get(name, ())
+
+        encoding = None
+        for accepted, extension in ENCODINGS:
+            if accepted in encodings and request.accept_encodings[accepted] > 0:
+                encoding = accepted
+                name += extension
+                break
+
+        # Sets Cache-Control: public, max-age and a matching Expires header:
+        response = send_from_directory(self.build_dir, name, mimetype=mimetype, cache_timeout=MAX_AGE)
+
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if encodings:
+            # The response depends on Accept-Encoding, so caches must keep each version apart:
+            response.vary.add("Accept-Encoding")
+
+        # Browsers needn't revalidate even on reload (Werkzeug has no attribute for it, so it's set as a bare directive):
+        response.cache_control["immutable"] = None
+        return response
+
+
+if __name__ == "__main__":
+    manifest = build(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+
+    print(f"Built {len(manifest['files'])} static files, {len(manifest['compressed'])} of them precompressed")
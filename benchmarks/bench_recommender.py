@@ -0,0 +1,84 @@
+"""
+Benchmark of the time and memory taken to build the book recommendations.
+
+Generates synthetic reviews, with book popularity following a power law like
+real review data, and times recommender.build_neighbours on them:
+
+    python3 benchmarks/bench_recommender.py --reviews 10000000 --users 500000 --books 100000
+
+Peak memory is the largest amount allocated by Python and NumPy at any point
+during the build, measured with tracemalloc.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from recommender import build_neighbours
+
+
+def synthetic_reviews(num_reviews, num_users, num_books, seed):
+    """Return (user_ids, book_ids, ratings) arrays of random reviews, without repeat reviews of a book by a user"""
+
+    rng = np.random.default_rng(seed)
+
+    # Popular books get far more reviews than the long tail:
+    popularity = 1 / np.arange(1, num_books + 1) ** 0.8
+    popularity /= popularity.sum()
+
+    user_ids = rng.integers(1, num_users + 1, num_reviews)
+    book_ids = rng.choice(np.arange(1, num_books + 1), num_reviews, p=popularity)
+
+    # Drop any repeat reviews of the same book by a user:
+    pairs = np.unique(user_ids * (num_books + 1) + book_ids)
+    user_ids, book_ids = pairs // (num_books + 1), pairs % (num_books + 1)
+
+    ratings = rng.choice([1, 2, 2, 3, 3, 3, 4, 4, 5, 5], len(pairs)).astype(np.float32)
+
+    return user_ids, book_ids, ratings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark building book recommendations from synthetic reviews")
+    parser.add_argument("--reviews", type=int, default=10000000, help="number of reviews to generate")
+    parser.add_argument("--users", type=int, default=500000, help="number of reviewers")
+    parser.add_argument("--books", type=int, default=100000, help="number of books")
+    parser.add_argument("--seed", type=int, default=50, help="random seed for the synthetic reviews")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"Generating {args.reviews} reviews of {args.books} books by {args.users} users...")
+    user_ids, book_ids, ratings = synthetic_reviews(args.reviews, args.users, args.books, args.seed)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    neighbours = build_neighbours(user_ids, book_ids, ratings)
+    build_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    results = {
+        "reviews": len(ratings),
+        "users": args.users,
+        "books": args.books,
+        "neighbours": len(neighbours[0]),
+        "build_seconds": round(build_time, 2),
+        "peak_memory_mb": round(peak_memory / 2 ** 20, 1),
+        "input_memory_mb": round((user_ids.nbytes + book_ids.nbytes + ratings.nbytes) / 2 ** 20, 1),
+    }
+
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Route-level benchmark and load test for READ-RATE.
+
+Creates the app with application.create_app() against a seeded database (use
+a disposable PostgreSQL database seeded with db_seed/import.py and
+db_seed/generate_data.py), with GoodReads scraping replaced by a stub, and
+drives each route from a number of concurrent clients:
+
+    BENCH_DATABASE_URL=postgresql://localhost/readrate_bench \\
+        python3 benchmarks/bench_routes.py --requests 200 --concurrency 8
+
+Clients are logged in, so pages are rendered for each request, apart from the
+"(logged out)" entries, which request a few popular pages of the routes whose
+logged out pages are cached, so they measure page cache hits.
+
+Reports p50/p95/p99 latency, throughput, SQL statements per request and page
+cache hit rate (pages and book cards) for each route, and writes the results
+as JSON. Pass --compare with an earlier results file to fail when a route has
+become slower or issues more queries.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Statements run by each benchmark thread's last request:
+statements = threading.local()
+
+# Pages requested by the logged out clients, so most of their requests are page cache hits:
+POPULAR_PAGES = 10
+
+
+def percentile(times, pct):
+    """Return the pct percentile of a sorted list of times"""
+
+    index = min(len(times) - 1, int(round(pct / 100 * (len(times) - 1))))
+    return times[index]
+
+
+def load_app():
+    """Import the app against the benchmark database, with GoodReads stubbed out"""
+
+    if os.getenv("BENCH_DATABASE_URL"):
+        os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL")
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+    import goodreads
+    goodreads.get_rating = lambda isbn, **kwargs: ("4.00", "1000")
+
+    from application import create_app
+
+    app = create_app()
+    metrics = app.extensions["readrate"].metrics
+
+    # Take each request's statement count from the app's metrics, which also count the statements its queries run on
+    # QueryPool threads. Teardown runs on the client's thread, before the metrics are done with the request:
+    @app.teardown_request
+    def count_statements(exception):
+        stats = metrics.current()
+        statements.count = stats.sql_count if stats else 0
+
+    return app
+
+
+def sample_targets(db, size):
+    """Pick sample book ids, ISBNs, authors, users and search terms from the database"""
+
+    books = db.execute("SELECT id, isbn, title, author FROM books ORDER BY id LIMIT :size", {"size": size * 10}).fetchall()
+    users = db.execute("SELECT id FROM users WHERE num_reviews > 0 ORDER BY id LIMIT :size", {"size": size}).fetchall()
+    db.remove()
+
+    books = random.sample(books, min(size, len(books)))
+
+    return {
+        "book_ids": [book[0] for book in books],
+        "isbns": [book[1] for book in books],
+        "titles": [book[2].split()[0] for book in books if book[2].split()],
+        "authors": [book[3] for book in books],
+        "user_ids": [user[0] for user in users],
+    }
+
+
+def route_requests(targets):
+    """Return (a function that makes one request with a test client, whether the client logs in) per route"""
+
+    popular_ids = targets["book_ids"][:POPULAR_PAGES]
+    popular_authors = targets["authors"][:POPULAR_PAGES]
+
+    return {
+        "/": (lambda client: client.get("/"), True),
+        "/search (title)": (lambda client: client.post("/search", data={"search-type": "title", "search-text": random.choice(targets["titles"])}), True),
+        "/search (author)": (lambda client: client.post("/search", data={"search-type": "author", "search-text": random.choice(targets["authors"]).split()[-1]}), True),
+        "/book_details/<id>": (lambda client: client.get(f"/book_details/{random.choice(targets['book_ids'])}"), True),
+        "/author_details/<name>": (lambda client: client.get(f"/author_details/{random.choice(targets['authors'])}"), True),
+        "/user_details/<id>": (lambda client: client.get(f"/user_details/{random.choice(targets['user_ids'])}"), True),
+        "/recommended": (lambda client: client.get("/recommended"), True),
+        "/api/<isbn>": (lambda client: client.get(f"/api/{random.choice(targets['isbns'])}"), True),
+        "/api/books (50)": (lambda client: client.get("/api/books?isbn=" + ",".join(random.sample(targets["isbns"], 50))), True),
+        "/ (logged out)": (lambda client: client.get("/"), False),
+        "/book_details/<id> (logged out)": (lambda client: client.get(f"/book_details/{random.choice(popular_ids)}"), False),
+        "/author_details/<name> (logged out)": (lambda client: client.get(f"/author_details/{random.choice(popular_authors)}"), False),
+    }
+
+
+def run_route(app, make_request, user_ids, num_requests, concurrency):
+    """
+    Make num_requests requests from concurrency clients, logged in as one of
+    user_ids unless it is None, returns per-request times, statement counts
+    and the page cache hit rate
+    """
+
+    page_cache = app.extensions["readrate"].page_cache
+    cache_before = page_cache.stats()
+    times = []
+    counts = []
+    errors = []
+    lock = threading.Lock()
+    remaining = iter(range(num_requests))
+
+    def client_loop():
+        client = app.test_client()
+
+        # Log each client in, for routes that need a user:
+        if user_ids is not None:
+            with client.session_transaction() as sess:
+                sess["user_id"] = random.choice(user_ids)
+                sess["username"] = "benchmark"
+
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+
+            statements.count = 0
+            start = time.perf_counter()
+            response = make_request(client)
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                times.append(elapsed)
+                counts.append(statements.count)
+                if response.status_code >= 500:
+                    errors.append(response.status_code)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        clients = [pool.submit(client_loop) for _ in range(concurrency)]
+        for client in clients:
+            client.result()
+    wall_time = time.perf_counter() - start
+
+    times.sort()
+
+    hits = page_cache.stats()["hits"] - cache_before["hits"]
+    lookups = hits + page_cache.stats()["misses"] - cache_before["misses"]
+
+    return {
+        "requests": len(times),
+        "errors": len(errors),
+        "throughput": len(times) / wall_time,
+        "p50_ms": percentile(times, 50) * 1000,
+        "p95_ms": percentile(times, 95) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "statements_per_request": sum(counts) / len(counts),
+        "max_statements": max(counts),
+        "cache_hit_rate": hits / lookups if lookups else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions in results compared with a baseline results file"""
+
+    regressions = []
+
+    for route, stats in results["routes"].items():
+        old = baseline["routes"].get(route)
+        if not old:
+            continue
+
+        if stats["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {old['p95_ms']:.1f}ms -> {stats['p95_ms']:.1f}ms")
+
+        if stats["max_statements"] > old["max_statements"]:
+            regressions.append(f"{route}: statements {old['max_statements']} -> {stats['max_statements']}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark READ-RATE routes against a seeded database")
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per route")
+    parser.add_argument("--warmup", type=int, default=20, help="untimed requests per route before measuring")
+    parser.add_argument("--routes", nargs="*", help="only benchmark these routes")
+    parser.add_argument("--seed", type=int, default=50, help="random seed for picking books, users and search terms")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed fractional p95 increase when comparing")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    app = load_app()
+    targets = sample_targets(app.extensions["readrate"].db, 200)
+
+    results = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "routes": {},
+    }
+
+    print(f"{'route':<38}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'SQL/req':>9}{'hits %':>8}{'errors':>8}")
+
+    for route, (make_request, logged_in) in route_requests(targets).items():
+        if args.routes and route not in args.routes:
+            continue
+
+        user_ids = targets["user_ids"] if logged_in else None
+
+        if args.warmup:
+            run_route(app, make_request, user_ids, args.warmup, args.concurrency)
+        stats = run_route(app, make_request, user_ids, args.requests, args.concurrency)
+        results["routes"][route] = stats
+
+        hit_rate = "-" if stats["cache_hit_rate"] is None else f"{stats['cache_hit_rate'] * 100:.0f}"
+        print(f"{route:<38}{stats['throughput']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}{stats['p99_ms']:>9.1f}"
+              f"{stats['statements_per_request']:>9.1f}{hit_rate:>8}{stats['errors']:>8}")
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print("REGRESSION " + regression)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Micro-benchmark of preparing and rendering review listings.
+
+Compares the old approach - copying every query row into a list, appending
+its star image and overwriting its date with strftime (add_star_img and
+form_time) for templates that index rows by position - with the row models
+in models.py, which are made straight from the query result and formatted by
+Jinja filters as they render:
+
+    python3 benchmarks/bench_rows.py --rows 10000
+
+Rows come from a real SQLAlchemy result, using an in-memory SQLite database so
+no PostgreSQL server is needed. The best prepare, render and total (prepare
+plus render, from the same run) times are reported, and allocations are
+measured with tracemalloc.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import datetime
+import tracemalloc
+
+from jinja2 import Environment
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from helpers import star_img, review_date
+from models import BookReview, rows
+
+# The review listing from book_details.html, before and after the row models:
+OLD_TEMPLATE = """{% for review in reviews %}
+<h5><img src="/static/{{ review[6] }}"> - by <a href="/user_details/{{review[0]}}">{{ review[1] }}</a></h5>
+<p class="date">Reviewed {{ review[3] }}</p><p>{{ review[2] }}</p>
+{% endfor %}"""
+
+NEW_TEMPLATE = """{% for review in reviews %}
+<h5><img src="/static/{{ review.rating|star_img }}"> - by <a href="/user_details/{{review.user_id}}">{{ review.username }}</a></h5>
+<p class="date">Reviewed {{ review.date|review_date }}</p><p>{{ review.text }}</p>
+{% endfor %}"""
+
+
+def add_star_img(sql_list):
+    """The old helper - copies each row into a list and appends its star image"""
+
+    new_list = []
+
+    for item in sql_list:
+        new_item = list(item)
+
+        rating = item[-1]
+
+        if rating == 0:
+            new_item.append('no_rating.png')
+        else:
+            new_item.append(str(round(rating)) + '_star.png')
+        new_list.append(new_item)
+
+    return new_list
+
+
+def form_time(review_list):
+    """The old helper - overwrites each review's date with a formatted string"""
+
+    for review in review_list:
+        review[3] = review[3].strftime('%d %b %Y')
+
+    return review_list
+
+
+def review_rows(num_rows, seed):
+    """Return a SQLAlchemy connection and query for num_rows random reviews"""
+
+    rng = random.Random(seed)
+    # Have SQLite return dates as datetimes, as PostgreSQL does:
+    engine = create_engine("sqlite://", connect_args={"detect_types": sqlite3.PARSE_DECLTYPES})
+    conn = engine.connect()
+
+    conn.execute("CREATE TABLE reviews (user_id INTEGER, username VARCHAR, text VARCHAR, date TIMESTAMP, id INTEGER, rating INTEGER)")
+    conn.execute("INSERT INTO reviews VALUES (?, ?, ?, ?, ?, ?)", [
+        (rng.randrange(1000), f"user{rng.randrange(1000)}", "A great read, looking forward to reading again in the future",
+         datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=rng.randrange(10 ** 7)), i, rng.randint(1, 5))
+        for i in range(num_rows)])
+
+    return conn, "SELECT user_id, username, text, date, id, rating FROM reviews"
+
+
+def measure(prepare, template, conn, query, repeat):
+    """Return the best times, and the allocations, of preparing and rendering the rows"""
+
+    prepare_times = []
+    render_times = []
+    total_times = []
+
+    for _ in range(repeat):
+        result = conn.execute(query).fetchall()
+
+        start = time.perf_counter()
+        reviews = prepare(result)
+        prepared = time.perf_counter()
+        template.render(reviews=reviews)
+        end = time.perf_counter()
+
+        prepare_times.append(prepared - start)
+        render_times.append(end - prepared)
+        total_times.append(end - start)
+
+    result = conn.execute(query).fetchall()
+    tracemalloc.start()
+    reviews = prepare(result)
+    prepared = tracemalloc.get_traced_memory()[0]
+    template.render(reviews=reviews)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "prepare_ms": min(prepare_times) * 1000,
+        "render_ms": min(render_times) * 1000,
+        "total_ms": min(total_times) * 1000,
+        "prepared_kb": prepared / 1024,
+        "peak_kb": peak / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preparing and rendering review listings")
+    parser.add_argument("--rows", type=int, default=10000, help="reviews in the listing")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each approach, the best is reported")
+    parser.add_argument("--seed", type=int, default=50, help="random seed for the reviews")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    env = Environment(autoescape=True)
+    env.filters["star_img"] = star_img
+    env.filters["review_date"] = review_date
+
+    conn, query = review_rows(args.rows, args.seed)
+
+    results = {
+        "rows": args.rows,
+        "old": measure(lambda result: form_time(add_star_img(result)), env.from_string(OLD_TEMPLATE), conn, query, args.repeat),
+        "new": measure(lambda result: rows(BookReview, result), env.from_string(NEW_TEMPLATE), conn, query, args.repeat),
+    }
+
+    print(f"{'':<6}{'prepare ms':>12}{'render ms':>12}{'total ms':>12}{'prepared KB':>14}{'peak KB':>10}")
+    for name in ("old", "new"):
+        stats = results[name]
+        print(f"{name:<6}{stats['prepare_ms']:>12.1f}{stats['render_ms']:>12.1f}{stats['total_ms']:>12.1f}{stats['prepared_kb']:>14.0f}{stats['peak_kb']:>10.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
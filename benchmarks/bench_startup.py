@@ -0,0 +1,112 @@
+"""
+Cold start benchmark for READ-RATE.
+
+Times importing application.py and calling create_app() in fresh Python
+processes, as each prefork worker (without --preload) and each test does,
+and checks that it doesn't load modules that only some requests need - the
+database driver, requests (used by the GoodReads scraper and the cover
+fetcher) and NumPy/SciPy. No database is needed, as the app only connects on
+its first request:
+
+    python3 benchmarks/bench_startup.py --runs 10 --budget 100
+
+Most of the start time is importing Flask/Werkzeug and SQLAlchemy, which
+alone takes 230-300ms on a typical machine and varies by more than the app's
+own share with machine load. So fresh processes that only import those are
+timed alternately with the app, and the budget is for the app's median time
+over theirs - the part the app controls.
+
+Pass --preload to time create_app() with PRELOAD=1 against a real database
+(DATABASE_URL) instead, as run once by a pre-forking server's master.
+Exits with an error if the median start time is over the budget or a heavy
+module was loaded.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Modules that must not be loaded just by creating the app:
+HEAVY_MODULES = ("psycopg2", "requests", "numpy", "scipy")
+
+# Run in each fresh process - prints the start time and the heavy modules loaded:
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+from application import create_app
+app = create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({"ms": elapsed * 1000, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+# Run alternately with STARTUP - the frameworks every start has to import:
+FRAMEWORKS = """
+import json, time
+start = time.perf_counter()
+import flask, sqlalchemy.orm
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000, "loaded": []}))
+"""
+
+
+def start_once(preload, script=STARTUP % (HEAVY_MODULES,)):
+    """Run a start up script (default: start the app) in a fresh process, returns its time in ms and the heavy modules loaded"""
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", "postgresql://localhost/readrate_bench")
+    env.setdefault("API_KEY", "benchmark")
+    env.setdefault("SECRET_KEY", "benchmark")
+    env["PRELOAD"] = "1" if preload else "0"
+
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["ms"], result["loaded"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark READ-RATE app start up time")
+    parser.add_argument("--runs", type=int, default=10, help="fresh processes to start the app in")
+    parser.add_argument("--budget", type=float, default=100, help="maximum median start time over just importing Flask and SQLAlchemy, in ms")
+    parser.add_argument("--preload", action="store_true", help="also preload the app (needs a database)")
+    args = parser.parse_args()
+
+    times = []
+    framework_times = []
+    loaded = set()
+
+    for _ in range(args.runs):
+        elapsed, modules = start_once(args.preload)
+        times.append(elapsed)
+        loaded.update(modules)
+        framework_times.append(start_once(args.preload, FRAMEWORKS)[0])
+
+    times.sort()
+    median = statistics.median(times)
+    overhead = median - statistics.median(framework_times)
+
+    print(f"Start up over {args.runs} runs: median {median:.1f}ms, min {times[0]:.1f}ms, max {times[-1]:.1f}ms")
+    print(f"Importing Flask and SQLAlchemy alone: median {statistics.median(framework_times):.1f}ms")
+    print(f"The app's own start up: {overhead:.1f}ms (budget {args.budget:.0f}ms)")
+
+    failed = False
+
+    if overhead > args.budget:
+        print(f"OVER BUDGET by {overhead - args.budget:.1f}ms")
+        failed = True
+
+    # Preloading loads the scraper and connects on purpose:
+    if loaded and not args.preload:
+        print(f"HEAVY MODULES loaded at start up: {', '.join(sorted(loaded))}")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
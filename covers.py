@@ -0,0 +1,282 @@
+"""
+Book cover proxy for READ-RATE, backed by a content-addressed disk cache.
+
+Covers are fetched from the Open Library Covers API once, resized to the
+thumbnail sizes the site shows, and stored under their SHA-256 hash:
+
+    <cache_dir>/objects/ab/abcdef...jpg     thumbnail images, by content hash
+    <cache_dir>/isbn/<isbn>-<size>          the hash of a book's thumbnail,
+                                            'missing <time>' if it has no cover, or
+                                            'error <time>' if fetching it failed
+
+Thumbnails are made with Pillow if it is installed, otherwise Open Library's
+own medium and large images are stored as they are. To fetch the covers of
+every book ahead of time (e.g. after an import):
+
+    python3 covers.py --workers 8
+"""
+import io
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+
+from metrics import Metrics
+
+OPENLIBRARY_URL = "https://covers.openlibrary.org"
+
+# Thumbnail sizes (max width, max height) - twice the size they are shown at, for high density screens:
+SIZES = {
+    "S": (100, 140),
+    "L": (400, 600),
+}
+
+# Open Library image used for each size when Pillow isn't available to make thumbnails:
+OPENLIBRARY_SIZES = {
+    "S": "M",
+    "L": "L",
+}
+
+ISBN = re.compile(r"^[0-9]{9}[0-9Xx]$|^[0-9]{13}$")
+
+# Prefixes of the refs recording that a book has no cover, or that fetching it failed:
+MISSING = "missing"
+ERROR = "error"
+
+
+class CoverStore:
+    """
+    Fetches, resizes and caches book covers on disk. Identical images are
+    stored once, and books with no cover are remembered for negative_ttl
+    seconds so they go straight to the default cover. Failed fetches
+    (timeouts, server errors) are remembered for the shorter error_ttl, so an
+    Open Library outage doesn't hold up every page for the fetch timeout.
+    Files are written to a temporary name and renamed, so several app
+    processes can share one cache directory.
+    """
+
+    def __init__(self, cache_dir, session=None, base_url=OPENLIBRARY_URL, timeout=5, negative_ttl=604800, error_ttl=300, metrics=None):
+        self.cache_dir = cache_dir
+        self.session = session
+        self.base_url = base_url
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.error_ttl = error_ttl
+        self.metrics = metrics or Metrics()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.error_hits = 0
+        self.fetches = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def get(self, isbn, size):
+        """
+        Return (path, digest) of a book's cover thumbnail, fetching it if it
+        isn't cached, or None if the book has no cover (or it couldn't be
+        fetched). Raises ValueError for an invalid ISBN or size.
+        """
+
+        if size not in SIZES or not ISBN.match(isbn):
+            raise ValueError(f"No cover for ISBN {isbn} at size {size}")
+
+        ref = self._read_ref(isbn, size)
+
+        if ref and not ref.startswith((MISSING, ERROR)):
+            self._count("hits")
+            return self._object_path(ref), ref
+
+        if ref:
+            kind, recorded = ref.split()
+            if kind == MISSING and time.time() - float(recorded) < self.negative_ttl:
+                self._count("negative_hits")
+                return None
+            if kind == ERROR and time.time() - float(recorded) < self.error_ttl:
+                self._count("error_hits")
+                return None
+
+        self.fetch(isbn)
+
+        ref = self._read_ref(isbn, size)
+        if ref and not ref.startswith((MISSING, ERROR)):
+            return self._object_path(ref), ref
+
+        return None
+
+    def fetch(self, isbn):
+        """Fetch a book's cover from Open Library and store its thumbnails, returns whether it has one"""
+
+        self._count("fetches")
+
+        try:
+            thumbnails = self._thumbnails(isbn)
+        except OSError:
+            # Network (requests' errors are OSErrors) or image errors may be temporary, so they're only remembered for
+            # error_ttl - keeping any size already stored:
+            self._count("errors")
+            for size in SIZES:
+                ref = self._read_ref(isbn, size)
+                if not ref or ref.startswith((MISSING, ERROR)):
+                    self._write_ref(isbn, size, f"{ERROR} {time.time()}")
+            return False
+
+        if thumbnails is None:
+            for size in SIZES:
+                self._write_ref(isbn, size, f"{MISSING} {time.time()}")
+            return False
+
+        for size, image in thumbnails.items():
+            self._write_ref(isbn, size, self._store_object(image))
+
+        return True
+
+    def is_cached(self, isbn):
+        """Whether every size of a book's cover, or the fact it has none, is already cached - failed fetches aren't"""
+
+        refs = [self._read_ref(isbn, size) for size in SIZES]
+        return all(ref and not ref.startswith(ERROR) for ref in refs)
+
+    def stats(self):
+        """Return the cache hit, fetch and error counters"""
+
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "error_hits": self.error_hits,
+            "fetches": self.fetches,
+            "errors": self.errors,
+        }
+
+    def _thumbnails(self, isbn):
+        """Return a dict of JPEG bytes by size for a book's cover, or None if Open Library has no cover for it"""
+
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+
+        if Image is None:
+            thumbnails = {}
+            for size, openlibrary_size in OPENLIBRARY_SIZES.items():
+                image = self._download(isbn, openlibrary_size)
+                if image is None:
+                    return None
+                thumbnails[size] = image
+            return thumbnails
+
+        image = self._download(isbn, "L")
+        if image is None:
+            return None
+
+        original = Image.open(io.BytesIO(image)).convert("RGB")
+
+        thumbnails = {}
+        for size, dimensions in SIZES.items():
+            thumbnail = original.copy()
+            thumbnail.thumbnail(dimensions, Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+            thumbnails[size] = buffer.getvalue()
+
+        return thumbnails
+
+    def _download(self, isbn, openlibrary_size):
+        session = self.session
+        if session is None:
+            # Only loaded once a cover has to be fetched, to keep app startup fast:
+            import requests
+            session = requests
+
+        # default=false makes Open Library answer 404 for books with no cover, rather than a blank image:
+        with self.metrics.external_call("openlibrary"):
+            response = session.get(f"{self.base_url}/b/isbn/{isbn}-{openlibrary_size}.jpg", params={"default": "false"}, timeout=self.timeout)
+
+        if response.status_code == 404:
+            return None
+
+        response.raise_for_status()
+
+        return response.content
+
+    def _store_object(self, image):
+        """Store image under its content hash, returns the hash"""
+
+        digest = hashlib.sha256(image).hexdigest()
+        path = self._object_path(digest)
+
+        if not os.path.exists(path):
+            self._write(path, image)
+
+        return digest
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest + ".jpg")
+
+    def _ref_path(self, isbn, size):
+        return os.path.join(self.cache_dir, "isbn", f"{isbn.upper()}-{size}")
+
+    def _read_ref(self, isbn, size):
+        try:
+            with open(self._ref_path(isbn, size)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _write_ref(self, isbn, size, ref):
+        self._write(self._ref_path(isbn, size), ref.encode())
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def warm(store, isbns, workers=8):
+    """Fetch the covers of all of the given ISBNs that aren't cached yet, returns (fetched, missing, skipped)"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    pending = [isbn for isbn in isbns if ISBN.match(isbn) and not store.is_cached(isbn)]
+    skipped = len(isbns) - len(pending)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        found = list(executor.map(store.fetch, pending))
+
+    return sum(found), len(found) - sum(found), skipped
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Fetch and cache the cover of every book in the database")
+    parser.add_argument("--workers", type=int, default=8, help="covers fetched at the same time")
+    parser.add_argument("--cache-dir", default=os.getenv("COVER_CACHE_DIR", "cover_cache"), help="cover cache directory")
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    with engine.connect() as conn:
+        isbns = [row[0] for row in conn.execute("SELECT isbn FROM books ORDER BY id")]
+
+    print(f"Warming covers for {len(isbns)} books...")
+    start = time.time()
+
+    fetched, missing, skipped = warm(CoverStore(args.cache_dir), isbns, args.workers)
+
+    print(f"Fetched {fetched} covers, {missing} books have no cover, {skipped} already cached, in {time.time() - start:.1f}s")
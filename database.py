@@ -0,0 +1,272 @@
+""" Database engines, connection pools and read replica routing for READ-RATE """
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select, TextClause
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection, including pre-ping and connecting"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._stats_lock = threading.Lock()
+
+    # Sessions and engine.connect() check out through connect(), engine.raw_connection() through unique_connection():
+    def connect(self):
+        return self._timed(super().connect)
+
+    def unique_connection(self):
+        return self._timed(super().unique_connection)
+
+    def _timed(self, checkout):
+        start = time.perf_counter()
+        timed_out = False
+
+        try:
+            return checkout()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._stats_lock:
+                self.waits += 1
+                self.timeouts += timed_out
+                self.total_wait += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+    def stats(self):
+        """Connections in use and checkout wait times for the pool"""
+
+        with self._stats_lock:
+            return {
+                "size": self.size(),
+                "checked_out": self.checkedout(),
+                "overflow": max(0, self.overflow()),
+                "checkouts": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": self.total_wait / self.waits * 1000 if self.waits else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+def create_db_engine(url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800, pool_pre_ping=True):
+    """
+    Create an engine with a TimedQueuePool of pool_size connections, plus up
+    to max_overflow more under load. Connections are checked before use if
+    pool_pre_ping is set and replaced after pool_recycle seconds, so
+    connections dropped by the server or a proxy aren't handed to requests.
+    SQLite databases, used as local stand-ins, keep SQLAlchemy's own pooling.
+    """
+
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_engine(url)
+
+    return create_engine(url, poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                         pool_timeout=pool_timeout, pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping)
+
+
+def is_read(clause):
+    """Whether a statement only reads - plain SELECTs, not SELECT ... FOR UPDATE or data-modifying CTEs"""
+
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+
+    if isinstance(clause, TextClause):
+        sql = clause.text.lstrip().upper()
+        return sql.startswith("SELECT") and "FOR UPDATE" not in sql
+
+    return False
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to the replica engine in info["replica"], once
+    one has been chosen for it, and everything else to the primary - its
+    bind, or else the primary engine of database
+    """
+
+    def __init__(self, database=None, **kwargs):
+        super().__init__(**kwargs)
+        self.database = database
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get("replica")
+
+        if replica is not None and is_read(clause):
+            return replica
+
+        if self.bind is None and self.database is not None:
+            return self.database.primary
+
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+class Database:
+    """
+    The primary database and any read replicas, with a scoped session bound
+    to the primary. Calling read_from_replica() sends the rest of the current
+    session's reads to a randomly chosen replica - the same one for the
+    whole session, so a request sees a consistent view of the data.
+
+    The engines are only created when first used, so setting up the app
+    doesn't load the database driver or connect, and functions registered
+    with on_engine() are called with each engine as it is created.
+    """
+
+    def __init__(self, url, replica_urls=(), **pool_options):
+        self.url = url
+        self.replica_urls = list(replica_urls)
+        self.pool_options = pool_options
+        self.session = scoped_session(sessionmaker(class_=RoutingSession, database=self))
+
+        self._engines = None
+        self._engine_hooks = []
+        self._lock = threading.Lock()
+
+    @property
+    def engines(self):
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    engines = [create_db_engine(url, **self.pool_options) for url in [self.url] + self.replica_urls]
+                    for engine in engines:
+                        for hook in self._engine_hooks:
+                            hook(engine)
+                    self._engines = engines
+
+        return self._engines
+
+    @property
+    def primary(self):
+        return self.engines[0]
+
+    @property
+    def replicas(self):
+        return self.engines[1:]
+
+    def on_engine(self, hook):
+        """Call hook(engine) for each engine, when it is created (or now, if it has been)"""
+
+        with self._lock:
+            self._engine_hooks.append(hook)
+            for engine in self._engines or ():
+                hook(engine)
+
+    def read_from_replica(self):
+        if self.replica_urls:
+            self.session().info["replica"] = random.choice(self.replicas)
+
+    def pool_names(self):
+        """Names of the engines' pools - 'primary', 'replica_1', ..."""
+
+        return ["primary"] + [f"replica_{i}" for i in range(1, len(self.replica_urls) + 1)]
+
+    def pool_stats(self, name):
+        """Return the stats of a named engine's TimedQueuePool, or an empty dict before the engine is created"""
+
+        if self._engines is None:
+            return {}
+
+        pool = self._engines[self.pool_names().index(name)].pool
+
+        return pool.stats() if isinstance(pool, TimedQueuePool) else {}
+
+    def dispose(self):
+        """Close the engines' pooled connections, e.g. before forking, so no two processes share a connection"""
+
+        for engine in self._engines or ():
+            engine.dispose()
+
+
+class QueryPoolFull(Exception):
+    """Raised by QueryPool.submit when max_pending calls are already waiting or running"""
+
+
+class QueryPool:
+    """
+    Runs independent queries for a request at the same time, each on a
+    worker thread with its own session, and so its own pooled connection.
+    Workers read from the same replica as the request that submitted them.
+    wrap, if given, is applied to each function in the submitting thread
+    (e.g. Metrics.bind, to count its statements against the request).
+    If max_pending is set, submit() refuses calls beyond it rather than
+    queueing them.
+    """
+
+    def __init__(self, database, workers=8, wrap=None, max_pending=None, name="query"):
+        self.database = database
+        self.wrap = wrap
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        """Run func(session, *args, **kwargs) on a worker, returns a Future for its result"""
+
+        with self._lock:
+            if self.max_pending is not None and self._pending >= self.max_pending:
+                raise QueryPoolFull(f"{self._pending} calls are already pending")
+            self._pending += 1
+
+        replica = self.database.session().info.get("replica")
+        call = (func, args, kwargs)
+
+        if self.wrap:
+            func = self.wrap(func)
+
+        future = self._executor.submit(self._run, replica, func, args, kwargs)
+        future.add_done_callback(self._done)
+        future.call = call
+
+        return future
+
+    def result(self, future, wait=0.5, timeout=10):
+        """
+        Return the result of a call submitted to the pool. If no worker has
+        started it within wait seconds, because they are all busy, it is
+        cancelled and run in this thread, on this thread's session, instead.
+        A call a worker has started gets timeout seconds more to finish,
+        then FutureTimeout is raised, so a request never waits forever.
+        """
+
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeout:
+            if future.cancel():
+                func, args, kwargs = future.call
+                return func(self.database.session, *args, **kwargs)
+
+        return future.result(timeout=timeout)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, replica, func, args, kwargs):
+        session = self.database.session()
+
+        if replica is not None:
+            session.info["replica"] = replica
+
+        try:
+            return func(session, *args, **kwargs)
+        finally:
+            # Scoped sessions are per thread, release this worker's session and connection:
+            self.database.session.remove()
@@ -0,0 +1,162 @@
+# Seeds the database with users and random reviews for the books table:
+#
+#   python3 generate_data.py --users 200 --min-reviews 10 --max-reviews 30 --seed 50
+#
+# Each user gets between --min-reviews and --max-reviews reviews of different
+# random books. The same seed always generates the same users and reviews.
+# Users and reviews are written in bulk (reviews with PostgreSQL COPY), and
+# book review counts and ratings are calculated once at the end, so the
+# generator scales to millions of users for capacity testing.
+import os
+import io
+import csv
+import time
+import random
+import argparse
+import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from werkzeug.security import generate_password_hash
+
+from reconcile_ratings import reconcile_ratings
+
+SEED_DIR = os.path.dirname(os.path.abspath(__file__))
+
+one_star = ["Hated it!", "Worst book I've read in a while!", "Did not enjoy this book at all.", "Had to return the book as I found it completely unreadable.", "Would not recommend this book to anyone."]
+
+two_star = ["Didn't really like the book.", "Not the right book for me", "Fans of the genre might like it but I did not enjoy it.", "Not my favorite read.", "Below Average!"]
+
+three_star = ["Book was okay for me, I think fans of the genre would really enjoy it!", "I enjoyed the book although some aspects could be better!", "Pretty average but enjoyable!", "Not a bad read at all", "Quite enjoyable, would recommend to pick up if on sale."]
+
+four_star = ["Really enjoyed this book", "A great read, looking forward to reading again in the future", "Great book that might interest those who don't normally enjoy this genre.", "Very well written book on the subject!", "One of the better books I have read this year!"]
+
+five_star = ["Fantastic - already reading again!", "Enjoyed this book so much, I would recommend to all my friends and family", "If you read one book this year, read this one!", "An absolute masterpiece - full marks.", "Can't wait to read the next book by this author!"]
+
+review_map = {1: one_star, 2: two_star, 3: three_star, 4: four_star, 5: five_star}
+
+# Ratings drawn uniformly from this list - mostly 3-5 stars:
+review_dist = [1, 2, 2, 3, 3, 3, 4, 4, 5, 5]
+
+# Reviews are dated between these times:
+FIRST_DATE = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+DATE_RANGE = 88 * 24 * 60 * 60
+
+
+def load_names():
+  """Load names from the two CSV files of baby names"""
+
+  namelist = []
+
+  for filename in ("names1.csv", "names2.csv"):
+    with open(os.path.join(SEED_DIR, filename)) as f:
+      for line in csv.reader(f):
+        namelist.append(line[2])
+
+  # Some names appear in both files:
+  return list(dict.fromkeys(namelist))
+
+
+def usernames(namelist, count):
+  """Yield count distinct usernames, numbering names once they have all been used"""
+
+  for i in range(count):
+    name = namelist[i % len(namelist)]
+    round_num = i // len(namelist)
+    yield name if round_num == 0 else f"{name}{round_num}"
+
+
+def batches(iterable, size):
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Generate users and reviews for the READ-RATE database")
+  parser.add_argument("--users", type=int, help="number of users to generate (default: one per name in the name CSVs)")
+  parser.add_argument("--min-reviews", type=int, default=10, help="fewest reviews per user")
+  parser.add_argument("--max-reviews", type=int, default=30, help="most reviews per user")
+  parser.add_argument("--seed", type=int, default=50, help="random seed, the same seed generates the same data")
+  parser.add_argument("--batch-size", type=int, default=10000, help="users written and committed per batch")
+  parser.add_argument("--password", default="autouserpassword\"3$5^", help="password given to every generated user")
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  namelist = load_names()
+  user_count = args.users or len(namelist)
+
+  engine = create_engine(os.getenv("DATABASE_URL"))
+  db = scoped_session(sessionmaker(bind=engine))
+
+  # All users share a password, so hash it once:
+  hash_pass = generate_password_hash(args.password)
+
+  # Books are sampled in memory rather than by the database:
+  book_ids = [row[0] for row in db.execute("SELECT id FROM books ORDER BY id")]
+  db.remove()
+
+  if len(book_ids) < args.max_reviews:
+    raise SystemExit("Not enough books in the database - run import.py first!")
+
+  print(f"Adding {user_count} users and their reviews to the database...")
+
+  conn = engine.raw_connection()
+  cursor = conn.cursor()
+
+  users_added = 0
+  reviews_added = 0
+  start = time.time()
+
+  for names in batches(usernames(namelist, user_count), args.batch_size):
+
+    # Check usernames not already in database:
+    cursor.execute("SELECT username FROM users WHERE username = ANY(%s)", (names,))
+    taken = {row[0] for row in cursor.fetchall()}
+
+    for name in taken:
+      print(f"Username: {name} already in use! Not added to users table.")
+
+    names = [name for name in names if name not in taken]
+    review_counts = [rng.randint(args.min_reviews, args.max_reviews) for name in names]
+
+    # Add the batch of users to the users table:
+    cursor.execute("INSERT INTO users (username, hash, num_reviews) SELECT name, %s, num_reviews FROM unnest(%s::VARCHAR[], %s::INTEGER[]) AS new_users(name, num_reviews) RETURNING id, username", (hash_pass, names, review_counts))
+    user_ids = dict((username, user_id) for user_id, username in cursor.fetchall())
+
+    # Write each user's reviews of different random books:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    for name, num_reviews in zip(names, review_counts):
+      for book_id in rng.sample(book_ids, num_reviews):
+        rev_rating = rng.choice(review_dist)
+        rev_text = rng.choice(review_map[rev_rating])
+        timestamp = FIRST_DATE + datetime.timedelta(seconds=rng.randrange(DATE_RANGE))
+
+        writer.writerow((user_ids[name], book_id, rev_text, rev_rating, timestamp.isoformat()))
+
+    buffer.seek(0)
+    cursor.copy_expert("COPY reviews (user_id, book_id, text, rating, date) FROM STDIN WITH (FORMAT csv)", buffer)
+    conn.commit()
+
+    users_added += len(names)
+    reviews_added += sum(review_counts)
+    print(f"Added {users_added} users and {reviews_added} reviews ({reviews_added / (time.time() - start):.0f} reviews/s)")
+
+  conn.close()
+
+  # Update books table with review counts and avg review scores, all at once:
+  print("Updating book ratings...")
+  reconcile_ratings(db)
+
+  print("User and review import completed!")
+
+
+if __name__ == "__main__":
+  main()
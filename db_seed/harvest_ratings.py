@@ -0,0 +1,159 @@
+# Harvests GoodReads ratings for every book into the goodreads_ratings table:
+#
+#   python3 harvest_ratings.py --workers 8 --rate 4
+#
+# Ratings are committed in batches, and books that already have a stored
+# rating are skipped, so an interrupted run resumes where it stopped.
+# --base-url points the harvester at another server (e.g. a local fake that
+# serves canned GoodReads pages) instead of www.goodreads.com.
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from goodreads import parse_rating, GOODREADS_URL
+
+
+class RateLimiter:
+  """Spaces out requests to a host so at most `rate` are started per second"""
+
+  def __init__(self, rate):
+    self.interval = 1.0 / rate if rate > 0 else 0
+    self.next_slot = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self):
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+
+    if slot > now:
+      time.sleep(slot - now)
+
+
+def fetch_rating(http, limiter, base_url, isbn, retries, backoff, timeout):
+  """Fetch one book's rating, retrying timeouts, 429s and 5xx errors with exponential backoff"""
+
+  for attempt in range(retries + 1):
+    limiter.wait()
+
+    try:
+      page = http.get(f"{base_url}/book/isbn/{isbn}", timeout=timeout)
+    except requests.RequestException:
+      page = None
+
+    if page is not None and page.status_code == 200:
+      return parse_rating(page.content)
+
+    # Book not on GoodReads, store no rating:
+    if page is not None and page.status_code < 500 and page.status_code != 429:
+      return ('N/A', 'N/A')
+
+    if attempt < retries:
+      time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+  # Out of retries - leave the book for the next run:
+  return None
+
+
+def store_ratings(db, ratings):
+  """Upsert a batch of (isbn, rating) results into goodreads_ratings"""
+
+  db.execute("INSERT INTO goodreads_ratings (isbn, average_rating, ratings_count, fetched_at) VALUES (:isbn, :average_rating, :ratings_count, CURRENT_TIMESTAMP) ON CONFLICT (isbn) DO UPDATE SET average_rating=EXCLUDED.average_rating, ratings_count=EXCLUDED.ratings_count, fetched_at=EXCLUDED.fetched_at",
+             [{"isbn": isbn, "average_rating": rating[0], "ratings_count": rating[1]} for isbn, rating in ratings])
+  db.commit()
+
+
+def pending_isbns(db, refresh=False):
+  """ISBNs of the books still to harvest - stored ratings act as the checkpoint, unless refreshing them all"""
+
+  if refresh:
+    return [row[0] for row in db.execute("SELECT isbn FROM books ORDER BY id")]
+
+  return [row[0] for row in db.execute("SELECT books.isbn FROM books LEFT JOIN goodreads_ratings ON books.isbn=goodreads_ratings.isbn WHERE goodreads_ratings.isbn IS NULL ORDER BY books.id")]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Harvest GoodReads ratings for all books in the database")
+  parser.add_argument("--workers", type=int, default=8, help="number of concurrent requests")
+  parser.add_argument("--rate", type=float, default=4, help="maximum requests started per second")
+  parser.add_argument("--retries", type=int, default=3, help="retries per book on errors")
+  parser.add_argument("--backoff", type=float, default=1, help="base backoff in seconds between retries")
+  parser.add_argument("--timeout", type=float, default=10, help="request timeout in seconds")
+  parser.add_argument("--batch-size", type=int, default=100, help="ratings committed per batch")
+  parser.add_argument("--refresh", action="store_true", help="re-fetch books that already have a stored rating")
+  parser.add_argument("--base-url", default=GOODREADS_URL, help="GoodReads server to fetch pages from")
+  args = parser.parse_args()
+
+  engine = create_engine(os.getenv("DATABASE_URL"))
+  db = scoped_session(sessionmaker(bind=engine))
+
+  isbns = pending_isbns(db, args.refresh)
+
+  print(f"Harvesting GoodReads ratings for {len(isbns)} books with {args.workers} workers")
+
+  # One pooled session shared by all workers:
+  http = requests.Session()
+  http.mount(args.base_url, HTTPAdapter(pool_connections=1, pool_maxsize=args.workers))
+  limiter = RateLimiter(args.rate)
+
+  batch = []
+  done = 0
+  failed = 0
+  start = time.time()
+
+  with ThreadPoolExecutor(max_workers=args.workers) as pool:
+    pending = {}
+    queue = iter(isbns)
+
+    while True:
+      # Keep a bounded number of requests in flight:
+      for isbn in queue:
+        future = pool.submit(fetch_rating, http, limiter, args.base_url, isbn, args.retries, args.backoff, args.timeout)
+        pending[future] = isbn
+        if len(pending) >= args.workers * 2:
+          break
+
+      if not pending:
+        break
+
+      finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+      for future in finished:
+        isbn = pending.pop(future)
+        rating = future.result()
+
+        if rating is None:
+          failed += 1
+          continue
+
+        batch.append((isbn, rating))
+
+      if len(batch) >= args.batch_size:
+        store_ratings(db, batch)
+        done += len(batch)
+        batch = []
+        print(f"Stored {done} ratings ({done / (time.time() - start):.1f}/s), {failed} failed")
+
+  if batch:
+    store_ratings(db, batch)
+    done += len(batch)
+
+  print(f"Harvest complete! Stored {done} ratings, {failed} failed - re-run to retry failed books.")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,29 +1,130 @@
 
 # Imports Data from books.csv into books table in DB:
+#
+#   python3 import.py [books.csv] [--chunk-size 10000]
+#
+# The CSV is streamed in chunks, so memory use doesn't depend on the size of
+# the file. Each chunk is loaded with PostgreSQL COPY into a staging table and
+# upserted into books on ISBN, then committed and recorded in a checkpoint
+# file. If a chunk fails, fix the problem and re-run the same command - the
+# import resumes after the last committed chunk. Run `python3 migrate.py up`
+# first - the upserts need the unique key on books.isbn.
 import os
+import sys
+import io
 import csv
+import time
+import argparse
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker
 
-engine = create_engine(os.getenv("DATABASE_URL"))
-db = scoped_session(sessionmaker(bind=engine))
 
-print("Importing Books")
+def read_chunks(reader, chunk_size, skip):
+  """
+  Yield (first row number, CSV buffer, row count) for each chunk of valid rows
+  after the first `skip` rows. Each row is written with its row number first.
+  """
 
-# Open books csv file
-f = open("books.csv")
-reader = csv.reader(f)
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  first = skip
+  count = 0
 
-# Skip Header
-next(reader)
+  for row_num, row in enumerate(reader):
+    if row_num < skip:
+      continue
 
-for isbn, title, author, year in reader:
+    if len(row) != 4:
+      print(f"Skipping malformed row {row_num + 1}: {row}")
+    else:
+      writer.writerow([row_num + 1] + row)
 
-  # Add each book to books table
-  db.execute("INSERT INTO books (isbn, title, author, year) VALUES (:isbn, :title, :author, :year)", {"isbn": isbn, "title": title, "author": author, "year": year})
+    count += 1
 
-  #print(f"Added book: {title} by {author}, ISNB: {isbn}, Published: {year}.")
-db.commit()
+    if count == chunk_size:
+      buffer.seek(0)
+      yield first, buffer, count
+      buffer = io.StringIO()
+      writer = csv.writer(buffer)
+      first += count
+      count = 0
 
-print("Book Import Complete!")
\ No newline at end of file
+  if count:
+    buffer.seek(0)
+    yield first, buffer, count
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Import books from a CSV file into the books table")
+  parser.add_argument("csv_file", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "books.csv"), help="CSV file with isbn,title,author,year columns")
+  parser.add_argument("--chunk-size", type=int, default=10000, help="rows loaded and committed per chunk")
+  parser.add_argument("--checkpoint", help="file recording committed rows (default: <csv_file>.checkpoint)")
+  parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and import from the first row")
+  args = parser.parse_args()
+
+  checkpoint = args.checkpoint or args.csv_file + ".checkpoint"
+
+  # Rows already committed by an earlier run:
+  skip = 0
+  if not args.restart and os.path.exists(checkpoint):
+    with open(checkpoint) as f:
+      skip = int(f.read().strip() or 0)
+    print(f"Resuming import after row {skip}")
+
+  engine = create_engine(os.getenv("DATABASE_URL"))
+
+  print("Importing Books")
+
+  conn = engine.raw_connection()
+  cursor = conn.cursor()
+  cursor.execute("CREATE TEMP TABLE books_import (line INTEGER, isbn VARCHAR, title VARCHAR, author VARCHAR, year INTEGER) ON COMMIT DELETE ROWS")
+  conn.commit()
+
+  imported = skip
+  start = time.time()
+
+  # Open books csv file
+  with open(args.csv_file, newline="") as f:
+    reader = csv.reader(f)
+
+    # Skip Header
+    next(reader)
+
+    for first, buffer, count in read_chunks(reader, args.chunk_size, skip):
+      chunk_start = time.time()
+
+      try:
+        cursor.copy_expert("COPY books_import (line, isbn, title, author, year) FROM STDIN WITH (FORMAT csv)", buffer)
+
+        # Last row wins if an ISBN appears twice in one chunk (later chunks overwrite earlier ones on conflict).
+        # Only books whose details change are updated, so re-imports leave the APIs' cache headers alone:
+        cursor.execute("INSERT INTO books (isbn, title, author, year) SELECT DISTINCT ON (isbn) isbn, title, author, year FROM books_import ORDER BY isbn, line DESC ON CONFLICT (isbn) DO UPDATE SET title=EXCLUDED.title, author=EXCLUDED.author, year=EXCLUDED.year, updated_at=CURRENT_TIMESTAMP(0) WHERE (books.title, books.author, books.year) IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.author, EXCLUDED.year)")
+        conn.commit()
+      except Exception as e:
+        conn.rollback()
+        print(f"Import failed in rows {first + 1}-{first + count}: {e}")
+        print(f"{imported} rows are committed - re-run to resume from row {imported + 1}.")
+        sys.exit(1)
+
+      imported = first + count
+
+      with open(checkpoint, "w") as cp:
+        cp.write(str(imported))
+
+      elapsed = time.time() - chunk_start
+      print(f"Imported {imported} rows ({count / elapsed:.0f} rows/s)")
+
+  conn.close()
+
+  total = imported - skip
+  print(f"Imported {total} rows in {time.time() - start:.1f}s ({total / max(time.time() - start, 0.001):.0f} rows/s)")
+
+  # The whole file is in, so the next run starts from the top again:
+  if os.path.exists(checkpoint):
+    os.remove(checkpoint)
+
+  print("Book Import Complete!")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,43 @@
+# Rebuilds every book's review count, rating total and average rating from the reviews table:
+#
+#   python3 reconcile_ratings.py
+#
+# The app keeps these aggregates up to date incrementally as reviews are
+# written. Run this after loading reviews outside the app, or to repair any
+# drift.
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+def reconcile_ratings(db):
+  """Recompute the review aggregates for all books in one statement, returns the number of books corrected"""
+
+  corrected = db.execute("""
+    UPDATE books
+    SET review_count=totals.review_count, rating_total=totals.rating_total, average_rating=totals.average_rating, reviews_updated=CURRENT_TIMESTAMP(0)
+    FROM (
+      SELECT books.id, COUNT(reviews.rating) AS review_count, COALESCE(SUM(reviews.rating), 0) AS rating_total,
+             COALESCE(ROUND(AVG(reviews.rating), 2), 0) AS average_rating
+      FROM books LEFT JOIN reviews ON books.id=reviews.book_id
+      GROUP BY books.id
+    ) AS totals
+    WHERE books.id=totals.id
+      AND (books.review_count, books.rating_total, books.average_rating) IS DISTINCT FROM (totals.review_count, totals.rating_total, totals.average_rating)
+  """).rowcount
+
+  db.commit()
+
+  return corrected
+
+
+if __name__ == "__main__":
+  engine = create_engine(os.getenv("DATABASE_URL"))
+  db = scoped_session(sessionmaker(bind=engine))
+
+  print("Reconciling book ratings with the reviews table...")
+
+  corrected = reconcile_ratings(db)
+
+  print(f"Rating reconciliation complete! {corrected} book(s) corrected.")
@@ -0,0 +1,50 @@
+""" GoodReads rating scraper for READ-RATE, imported on first use so app startup doesn't load requests """
+import re
+import requests
+
+GOODREADS_URL = "https://www.goodreads.com"
+
+
+def parse_rating(content):
+    """
+    Takes the content of a GoodReads book page, returns a tuple of the average
+    rating and number of ratings, or ('N/A', 'N/A') if no rating is found
+    """
+    # Find rating value with regular expression and return
+    pattern1 = re.compile("(?:\<span itemprop=\"ratingValue\"\>s*....)([\d]\.[\d]{2})")
+    # pattern1 = re.compile("\"\>\s*([\d]\.[\d]{2})\s*\<")
+    pattern2 = re.compile("(?:\<meta itemprop=\"ratingCount\" content=\")([\d]+)")
+    m1 = re.search(pattern1, str(content))
+    m2 = re.search(pattern2, str(content))
+    if m1 and m2:
+        rating = (m1.group(1), m2.group(1))
+        return rating
+
+    # Else no match found, return no rating
+    rating = ('N/A', 'N/A')
+    return rating
+
+
+def get_rating(ISBN, timeout=5, session=requests, base_url=GOODREADS_URL):
+    """
+    Takes book ISBN as a string, returns average review rating scraped from
+    GoodReads website. Gives up and returns no rating if GoodReads does not
+    respond within timeout seconds.
+    """
+    # Open Library
+    # URL = f"https://openlibrary.org/isbn/{ISBN}"
+
+    # GoodReads
+    URL = f"{base_url}/book/isbn/{ISBN}"
+
+    try:
+        page = session.get(URL, timeout=timeout)
+    except requests.RequestException:
+        return ('N/A', 'N/A')
+
+    if page.status_code == 200:
+        return parse_rating(page.content)
+
+    # Else no page found, return no rating
+    rating = ('N/A', 'N/A')
+    return rating
@@ -1,27 +1,24 @@
 """ Helper functions for READ-RATE applications """
-import re
-import requests
+import json
+import base64
 
-def add_star_img(sql_list):
-    """
-    Helper function to append correct star rating imgs to each book or review.
-    The book or review rating is the last entry in each tuple.
-    """
+from datetime import datetime
 
-    new_list = []
+# Star image of each whole rating - every review rating, so long listings look them up rather than format them:
+STAR_IMAGES = {0: 'no_rating.png', 1: '1_star.png', 2: '2_star.png', 3: '3_star.png', 4: '4_star.png', 5: '5_star.png'}
 
-    for item in sql_list:
-        new_item = list(item)
+# Month abbreviations, as strftime's %b gives them in the default C locale:
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
 
-        rating = item[-1]
 
-        if rating == 0:
-            new_item.append('no_rating.png')
-        else:
-            new_item.append(str(round(rating)) + '_star.png')
-        new_list.append(new_item)
+def star_img(rating):
+    """Jinja filter giving the star rating image for a book or review rating"""
 
-    return new_list
+    image = STAR_IMAGES.get(rating)
+    if image is None:
+        image = str(round(rating)) + '_star.png'
+
+    return image
 
 
 def validate_pass(password):
@@ -47,40 +44,98 @@ def validate_pass(password):
         return False
 
 
-def form_time(review_list):
-    """Function takes a list of reviews and formats the review date from a timestamp to 01 Jan 2019 etc """
+def review_date(date):
+    """Jinja filter formatting a review timestamp as 01 Jan 2019 etc - without strftime, which is several times slower"""
+
+    return '%02d %s %d' % (date.day, MONTHS[date.month - 1], date.year)
+
+
+def encode_cursor(values):
+    """Encodes the sort key values of a row as a URL-safe page cursor"""
+
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def date_key(value):
+    """Cursor key type of listings sorted by a timestamp - parses the encoded timestamp"""
+
+    return datetime.fromisoformat(value)
+
+
+def text_key(value):
+    """Cursor key type of listings sorted by a text column, e.g. a title"""
+
+    if not isinstance(value, str):
+        raise TypeError(f"Expected a string, got {value!r}")
+
+    return value
+
+
+def decode_cursor(cursor, key_type):
+    """
+    Decodes a page cursor made by encode_cursor, checking its sort key value
+    with key_type (e.g. date_key), which raises ValueError or TypeError for a
+    value of the wrong type. Returns None if the cursor is not valid.
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(values, list) or len(values) != 2 or not isinstance(values[1], int) or isinstance(values[1], bool):
+        return None
+
+    # A value of the wrong type would be an error in the database rather than an unknown page:
+    try:
+        return [key_type(values[0]), values[1]]
+    except (ValueError, TypeError):
+        return None
+
+
+def page_request(args, default_size, max_size, key_type):
+    """
+    Reads the after/before cursor and limit query string arguments of a request
+    for a page of results sorted by a key_type column. Returns the direction to
+    page in ('after', 'before' or None for the first page), the sort key values
+    to page from and the page size, which is limited to max_size.
+    """
+
+    try:
+        size = min(max(int(args.get("limit", default_size)), 1), max_size)
+    except ValueError:
+        size = default_size
 
-    for review in review_list:
-        review[3] = review[3].strftime('%d %b %Y')
+    for direction in ("after", "before"):
+        if args.get(direction):
+            values = decode_cursor(args.get(direction), key_type)
+            if values:
+                return direction, values, size
 
-    return review_list
+    return None, None, size
 
 
-def get_rating(ISBN):
+def page_cursors(rows, direction, size, key):
     """
-    Takes book ISBN as a string, returns average review rating scraped from
-    GoodReads website
+    Takes the rows fetched for a page - up to size + 1 rows, in reverse order
+    when paging backwards - and returns the page's rows in display order with
+    the cursors for the next and previous pages (None if there isn't one).
+    key returns the sort key values of a row.
     """
-    # Open Library
-    # URL = f"https://openlibrary.org/isbn/{ISBN}"
-
-    # GoodReads
-    URL = f"https://www.goodreads.com/book/isbn/{ISBN}"
-
-    page = requests.get(URL)
-
-    if page.status_code == 200:
-        # Find rating value with regular expression and return
-        pattern1 = re.compile("(?:\<span itemprop=\"ratingValue\"\>s*....)([\d]\.[\d]{2})")
-        # pattern1 = re.compile("\"\>\s*([\d]\.[\d]{2})\s*\<")
-        pattern2 = re.compile("(?:\<meta itemprop=\"ratingCount\" content=\")([\d]+)")
-        m1 = re.search(pattern1, str(page.content))
-        m2 = re.search(pattern2, str(page.content))
-        print("Matches: ",m1, m2)
-        if m1 and m2:
-            rating = (m1.group(1), m2.group(1))
-            return rating
-
-    # Else no match found, return no rating
-    rating = ('N/A', 'N/A')
-    return rating
+
+    more = len(rows) > size
+    rows = rows[:size]
+
+    if direction == "before":
+        rows = rows[::-1]
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, direction == "after"
+
+    if not rows:
+        return rows, None, None
+
+    next_cursor = encode_cursor(key(rows[-1])) if has_next else None
+    prev_cursor = encode_cursor(key(rows[0])) if has_prev else None
+
+    return rows, next_cursor, prev_cursor
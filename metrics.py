@@ -0,0 +1,303 @@
+""" Per-request performance instrumentation and Prometheus metrics for READ-RATE """
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, before_render_template, request, template_rendered
+from sqlalchemy import event
+
+from queries import query_stats
+
+logger = logging.getLogger("readrate.metrics")
+
+# Upper bounds, in seconds, of the request latency histogram buckets:
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statements shown in the slow request log, slowest first:
+SLOW_LOG_STATEMENTS = 5
+
+
+class RequestStats:
+    """What one request spent its time on"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.route = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.http_count = 0
+        self.http_time = 0.0
+        self.template_time = 0.0
+        self.template_start = None
+
+        # Count and total time of each distinct SQL statement:
+        self.statements = defaultdict(lambda: [0, 0.0])
+
+        # Queries and calls run on other threads for the request (see Metrics.bind) update the counts concurrently:
+        self.lock = threading.Lock()
+
+
+class RouteStats:
+    """Totals for all of the requests to one route"""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.time = 0.0
+        self.statuses = defaultdict(int)
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.http_count = 0
+        self.http_time = 0.0
+        self.template_time = 0.0
+        self.slow = 0
+        self.n_plus_one = 0
+
+
+class Metrics:
+    """
+    Records the latency of every request by route, with the number and time
+    of its SQL statements (from SQLAlchemy engine events), outbound HTTP
+    calls and template rendering, and serves them as Prometheus text on
+    /metrics. Requests slower than slow_ms are logged with their slowest
+    statements, and requests running more than max_statements statements
+    are logged as a likely N+1 query.
+    """
+
+    def __init__(self, slow_ms=500, max_statements=20):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+
+        self._routes = defaultdict(RouteStats)
+        self._external = defaultdict(lambda: [0, 0.0])
+        self._collectors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def init_app(self, app, path="/metrics"):
+        """Instrument the app's requests and template rendering, and add the metrics route"""
+
+        # Wrap the whole WSGI call, so session loading and saving are timed too:
+        wsgi_app = app.wsgi_app
+
+        def timed_wsgi_app(environ, start_response):
+            self._local.stats = RequestStats()
+            status = []
+
+            def timed_start_response(status_line, headers, exc_info=None):
+                status.append(status_line.split(" ", 1)[0])
+                return start_response(status_line, headers, exc_info)
+
+            try:
+                return wsgi_app(environ, timed_start_response)
+            finally:
+                self._finish(self._local.stats, environ.get("REQUEST_METHOD"), status[0] if status else "500")
+                self._local.stats = None
+
+        app.wsgi_app = timed_wsgi_app
+
+        @app.before_request
+        def name_route():
+            stats = self.current()
+            if stats:
+                stats.route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+
+        app.add_url_rule(path, "metrics", lambda: Response(self.render(), mimetype="text/plain; version=0.0.4"))
+
+    def instrument(self, engine):
+        """Time the engine's SQL statements, counting them against the requests that run them"""
+
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def add_collector(self, prefix, stats):
+        """Export the numbers returned by the stats() callable as readrate_<prefix>_<name> gauges"""
+
+        self._collectors.append((prefix, stats))
+
+    def current(self):
+        """Return the RequestStats of the request being handled by this thread, or None"""
+
+        return getattr(self._local, "stats", None)
+
+    def bind(self, func):
+        """
+        Wrap func to count its SQL statements and outbound calls against the
+        current request, for running it on another thread
+        """
+
+        stats = self.current()
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            previous = self.current()
+            self._local.stats = stats
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.stats = previous
+
+        return bound
+
+    @contextmanager
+    def external_call(self, service):
+        """Time an outbound HTTP call to service, counting it against the current request if there is one"""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            stats = self.current()
+            if stats:
+                with stats.lock:
+                    stats.http_count += 1
+                    stats.http_time += elapsed
+
+            with self._lock:
+                totals = self._external[service]
+                totals[0] += 1
+                totals[1] += elapsed
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+
+        stats = self.current()
+        if stats:
+            with stats.lock:
+                stats.sql_count += 1
+                stats.sql_time += elapsed
+                totals = stats.statements[statement]
+                totals[0] += 1
+                totals[1] += elapsed
+
+    def _before_render(self, app, template, context, **extra):
+        stats = self.current()
+        if stats:
+            stats.template_start = time.perf_counter()
+
+    def _after_render(self, app, template, context, **extra):
+        stats = self.current()
+        if stats and stats.template_start is not None:
+            stats.template_time += time.perf_counter() - stats.template_start
+            stats.template_start = None
+
+    def _finish(self, stats, method, status):
+        """Add a finished request to its route's totals, and log it if it was slow or ran too many statements"""
+
+        elapsed = time.perf_counter() - stats.start
+        route = stats.route or "unmatched"
+        slow = elapsed * 1000 >= self.slow_ms
+        n_plus_one = stats.sql_count > self.max_statements
+
+        with self._lock:
+            totals = self._routes[route]
+            totals.count += 1
+            totals.time += elapsed
+            totals.statuses[(method, status)] += 1
+            totals.sql_count += stats.sql_count
+            totals.sql_time += stats.sql_time
+            totals.http_count += stats.http_count
+            totals.http_time += stats.http_time
+            totals.template_time += stats.template_time
+            totals.slow += slow
+            totals.n_plus_one += n_plus_one
+
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    totals.buckets[i] += 1
+
+        if n_plus_one:
+            statement, (count, _) = max(stats.statements.items(), key=lambda item: item[1][0])
+            logger.warning("Likely N+1 query: %s %s ran %d SQL statements, the most repeated %d times: %s",
+                           method, route, stats.sql_count, count, " ".join(statement.split())[:200])
+
+        if slow:
+            breakdown = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)[:SLOW_LOG_STATEMENTS]
+            logger.warning("Slow request: %s %s took %.0fms - %d SQL statements in %.0fms, %d HTTP calls in %.0fms, templates %.0fms%s",
+                           method, route, elapsed * 1000, stats.sql_count, stats.sql_time * 1000,
+                           stats.http_count, stats.http_time * 1000, stats.template_time * 1000,
+                           "".join(f"\n  {count}x {time_taken * 1000:.1f}ms {' '.join(statement.split())[:200]}"
+                                   for statement, (count, time_taken) in breakdown))
+
+    def render(self):
+        """Return all of the metrics in the Prometheus text format"""
+
+        with self._lock:
+            routes = dict((route, (list(totals.buckets), totals.count, totals.time, dict(totals.statuses),
+                                   totals.sql_count, totals.sql_time, totals.http_count, totals.http_time,
+                                   totals.template_time, totals.slow, totals.n_plus_one))
+                          for route, totals in self._routes.items())
+            external = dict((service, list(totals)) for service, totals in self._external.items())
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}" if label_text else f"{name}{suffix} {value}")
+
+        latency = []
+        for route, (buckets, count, total, *_) in sorted(routes.items()):
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                latency.append(("_bucket", [("route", route), ("le", bound)], bucket_count))
+            latency.append(("_bucket", [("route", route), ("le", "+Inf")], count))
+            latency.append(("_sum", [("route", route)], total))
+            latency.append(("_count", [("route", route)], count))
+        metric("readrate_request_duration_seconds", "histogram", "Request latency by route", latency)
+
+        metric("readrate_requests_total", "counter", "Requests by route, method and status",
+               [("", [("route", route), ("method", method), ("status", status)], count)
+                for route, values in sorted(routes.items()) for (method, status), count in sorted(values[3].items())])
+
+        per_route = [
+            ("readrate_request_sql_statements_total", "SQL statements run by requests to each route", 4),
+            ("readrate_request_sql_seconds_total", "Time spent running SQL statements by requests to each route", 5),
+            ("readrate_request_http_calls_total", "Outbound HTTP calls made by requests to each route", 6),
+            ("readrate_request_http_seconds_total", "Time spent in outbound HTTP calls by requests to each route", 7),
+            ("readrate_request_template_seconds_total", "Time spent rendering templates by requests to each route", 8),
+            ("readrate_slow_requests_total", "Requests slower than the slow request threshold", 9),
+            ("readrate_n_plus_one_requests_total", "Requests that ran more SQL statements than the N+1 threshold", 10),
+        ]
+        for name, help_text, index in per_route:
+            metric(name, "counter", help_text, [("", [("route", route)], values[index]) for route, values in sorted(routes.items())])
+
+        metric("readrate_external_calls_total", "counter", "Outbound HTTP calls by service",
+               [("", [("service", service)], count) for service, (count, _) in sorted(external.items())])
+        metric("readrate_external_seconds_total", "counter", "Time spent in outbound HTTP calls by service",
+               [("", [("service", service)], total) for service, (_, total) in sorted(external.items())])
+
+        # Named queries from queries.py, with times in seconds:
+        queries = sorted(query_stats.snapshot().items())
+        for name, kind, help_text, key, scale in (
+                ("readrate_query_calls_total", "counter", "Calls of each named query", "calls", 1),
+                ("readrate_query_seconds_total", "counter", "Time spent running each named query", "total_ms", 0.001),
+                ("readrate_query_max_seconds", "gauge", "Slowest run of each named query", "max_ms", 0.001),
+                ("readrate_query_rows_total", "counter", "Rows returned or changed by each named query", "rows", 1)):
+            metric(name, kind, help_text, [("", [("query", query)], stats[key] * scale) for query, stats in queries])
+
+        for prefix, stats in self._collectors:
+            for key, value in sorted(stats().items()):
+                metric(f"readrate_{prefix}_{key}", "gauge", f"{prefix} {key.replace('_', ' ')}", [("", [], value)])
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    """Escape a Prometheus label value"""
+
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
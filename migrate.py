@@ -0,0 +1,235 @@
+"""
+Versioned schema migrations for READ-RATE.
+
+Each file in migrations/ is named <version>_<name>.sql and applied once, in
+version order, in its own transaction, which also records it in the
+schema_migrations table. The migrations only create what is missing, so
+databases set up by hand before they existed can be brought up to date too:
+
+    python3 migrate.py up           # apply all pending migrations
+    python3 migrate.py up --to 7    # apply pending migrations up to version 7
+    python3 migrate.py status       # list applied and pending migrations
+
+The migrations are the only place the schema is defined. The check command
+runs EXPLAIN on every statement the app runs, with sample parameters taken
+from the database, and exits with an error if any of them can't be planned
+against the schema, or would scan a table of at least --min-rows rows
+sequentially (other than the background loads in FULL_SCANS):
+
+    python3 migrate.py check
+"""
+import os
+import re
+import sys
+import argparse
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.elements import TextClause
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name VARCHAR NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )"""
+
+# Paged statements whose cursor is a (title, id) pair - the rest page by (date, id):
+TITLE_PAGED = ("queries.AUTHOR_BOOKS_PAGE",)
+
+# Statements that read a whole table by design, run in the background rather than for a request:
+FULL_SCANS = ("sampling.AUTHOR_NAMES", "sampling.TOP_RATED_IDS")
+
+
+def migrations():
+    """Return a list of (version, name, path) for the migration files, in version order"""
+
+    found = []
+
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+
+    return sorted(found)
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        conn.execute(CREATE_MIGRATIONS_TABLE)
+        return set(row[0] for row in conn.execute("SELECT version FROM schema_migrations"))
+
+
+def migrate(engine, target=None, skip=()):
+    """Apply the pending migrations up to target (default: all of them), apart from the versions in skip, returns the versions applied"""
+
+    applied = applied_versions(engine)
+    done = []
+
+    for version, name, path in migrations():
+        if version in applied or version in skip or (target is not None and version > target):
+            continue
+
+        with open(path) as f:
+            sql = f.read()
+
+        # Run through the DBAPI cursor, so the file can hold several statements:
+        conn = engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        print(f"Applied {version:04d}_{name}")
+        done.append(version)
+
+    return done
+
+
+def app_statements():
+    """Return every statement the app runs, by module and name"""
+    import queries
+    import ratings
+    import recommender
+    import sampling
+    import search
+    import sessions
+
+    statements = {}
+
+    for module in (queries, search, sampling, recommender, ratings, sessions):
+        for name, value in vars(module).items():
+            if isinstance(value, TextClause):
+                statements[f"{module.__name__}.{name}"] = value
+            elif isinstance(value, dict) and value and all(isinstance(item, TextClause) for item in value.values()):
+                for key, statement in value.items():
+                    statements[f"{module.__name__}.{name}[{key}]"] = statement
+
+    return statements
+
+
+def sample_params(conn):
+    """Parameters for EXPLAIN, taken from a real review so the planner sees typical values"""
+
+    row = conn.execute("""
+        SELECT reviews.id, reviews.user_id, users.username, reviews.book_id, books.isbn, books.title, books.author, reviews.date
+        FROM reviews INNER JOIN users ON reviews.user_id = users.id INNER JOIN books ON reviews.book_id = books.id
+        LIMIT 1""").fetchone()
+
+    if not row:
+        raise RuntimeError("The check needs at least one review in the database")
+
+    review_id, user_id, username, book_id, isbn, title, author, date = row
+
+    return {
+        "user_id": user_id, "username": username, "hash": "", "book_id": book_id, "isbn": isbn, "isbns": [isbn],
+        "ids": [book_id], "author": author, "text": title, "pattern": f"%{title}%", "rating": 4, "min_rating": 4,
+        "limit": 20, "authors": 10, "books": 6, "key_value": date, "key_id": review_id, "_title": title,
+        "average_rating": "4.00", "ratings_count": "1", "fetched_at": 0, "id": "", "data": "{}", "ttl": 86400,
+    }
+
+
+def seq_scans(plan):
+    """Yield the name of every table scanned sequentially in an EXPLAIN (FORMAT JSON) plan node"""
+
+    if plan.get("Node Type") == "Seq Scan":
+        yield plan["Relation Name"]
+
+    for child in plan.get("Plans", ()):
+        yield from seq_scans(child)
+
+
+def check(engine, min_rows=1000, only=None):
+    """EXPLAIN each app statement, returns the number that scan a large table sequentially or fail to plan"""
+
+    failures = 0
+
+    with engine.connect() as conn:
+        large = set(row[0] for row in conn.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace AND reltuples >= %s", (min_rows,)))
+        params = sample_params(conn)
+
+        for name, statement in sorted(app_statements().items()):
+            if only and not any(pattern in name for pattern in only):
+                continue
+
+            statement_params = dict(params)
+            if name.startswith(TITLE_PAGED):
+                statement_params["key_value"] = params["_title"]
+
+            # EXPLAIN without ANALYZE plans statements without running them, the
+            # transaction is rolled back anyway in case of mistakes:
+            transaction = conn.begin()
+            try:
+                plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + statement.text), statement_params).scalar()
+            except SQLAlchemyError as e:
+                print(f"ERROR      {name}: {str(e.orig if hasattr(e, 'orig') else e).strip().splitlines()[0]}")
+                failures += 1
+                continue
+            finally:
+                transaction.rollback()
+
+            scanned = sorted(set(seq_scans(plan[0]["Plan"])) & large)
+
+            if scanned and name in FULL_SCANS:
+                print(f"FULL SCAN  {name}: {', '.join(scanned)} (background)")
+            elif scanned:
+                print(f"SEQ SCAN   {name}: {', '.join(scanned)}")
+                failures += 1
+            else:
+                print(f"OK         {name}")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply READ-RATE schema migrations and check the app's query plans")
+    commands = parser.add_subparsers(dest="command")
+
+    up = commands.add_parser("up", help="apply pending migrations")
+    up.add_argument("--to", type=int, help="only apply migrations up to this version")
+
+    commands.add_parser("status", help="list applied and pending migrations")
+
+    check_parser = commands.add_parser("check", help="fail if any app statement scans a large table sequentially")
+    check_parser.add_argument("--min-rows", type=int, default=1000, help="tables with at least this many rows count as large")
+    check_parser.add_argument("--analyze", action="store_true", help="update the planner statistics first")
+    check_parser.add_argument("names", nargs="*", help="only check statements whose names contain one of these")
+
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+
+    if args.command == "status":
+        applied = applied_versions(engine)
+        for version, name, path in migrations():
+            print(f"{'applied' if version in applied else 'pending':<9}{version:04d}_{name}")
+
+    elif args.command == "check":
+        if args.analyze:
+            with engine.begin() as conn:
+                conn.execute("ANALYZE")
+
+        failures = check(engine, args.min_rows, args.names)
+        if failures:
+            print(f"{failures} statement(s) need attention")
+            sys.exit(1)
+        print("All statements use indexes on large tables")
+
+    else:
+        done = migrate(engine, getattr(args, "to", None))
+        print(f"Database is up to date ({len(done)} migration(s) applied)")
+
+
+if __name__ == "__main__":
+    main()
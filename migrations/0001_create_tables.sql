@@ -0,0 +1,26 @@
+-- Users, books and their reviews:
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR NOT NULL,
+    hash VARCHAR NOT NULL,
+    num_reviews INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS books (
+    id SERIAL PRIMARY KEY,
+    isbn VARCHAR NOT NULL,
+    title VARCHAR NOT NULL,
+    author VARCHAR NOT NULL,
+    year INTEGER NOT NULL,
+    review_count INTEGER NOT NULL DEFAULT 0,
+    average_rating NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS reviews (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users,
+    book_id INTEGER NOT NULL REFERENCES books,
+    text VARCHAR NOT NULL,
+    date TIMESTAMPTZ NOT NULL,
+    rating INTEGER NOT NULL
+);
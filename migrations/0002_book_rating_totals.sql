@@ -0,0 +1,19 @@
+-- Each book's rating total, kept up to date with review_count as reviews are
+-- written so average_rating needn't be recounted, and when they last changed
+-- (for the API's cache headers).
+ALTER TABLE books ADD COLUMN IF NOT EXISTS rating_total INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE books ADD COLUMN IF NOT EXISTS reviews_updated TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP(0);
+
+-- Fill them in for the books that already have reviews, with review_count and
+-- average_rating recounted from the same rows, so review writes adjust totals
+-- that agree with each other:
+UPDATE books
+SET review_count = totals.review_count, rating_total = totals.rating_total,
+    average_rating = ROUND(CAST(totals.rating_total AS NUMERIC) / totals.review_count, 2), reviews_updated = totals.reviews_updated
+FROM (
+    SELECT book_id, COUNT(*) AS review_count, SUM(rating) AS rating_total, DATE_TRUNC('second', MAX(date)) AS reviews_updated
+    FROM reviews
+    GROUP BY book_id
+) AS totals
+WHERE books.id = totals.book_id;
@@ -0,0 +1,7 @@
+-- Ratings scraped from GoodReads, shared by all app processes (ratings.py):
+CREATE TABLE IF NOT EXISTS goodreads_ratings (
+    isbn VARCHAR PRIMARY KEY,
+    average_rating VARCHAR NOT NULL,
+    ratings_count VARCHAR NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL
+);
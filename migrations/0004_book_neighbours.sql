@@ -0,0 +1,7 @@
+-- The most similar books to each book, rebuilt by recommender.py:
+CREATE TABLE IF NOT EXISTS book_neighbours (
+    book_id INTEGER NOT NULL REFERENCES books ON DELETE CASCADE,
+    neighbour_id INTEGER NOT NULL REFERENCES books ON DELETE CASCADE,
+    score REAL NOT NULL,
+    PRIMARY KEY (book_id, neighbour_id)
+);
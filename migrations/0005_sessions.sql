@@ -0,0 +1,8 @@
+-- Server side sessions for SESSION_BACKEND=database (sessions.py):
+CREATE TABLE IF NOT EXISTS sessions (
+    id VARCHAR PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS sessions_expires_idx ON sessions (expires);
@@ -0,0 +1,12 @@
+-- One account per username, one book per ISBN and one review per user per
+-- book. Any existing duplicates have to be removed before this will apply.
+
+-- Log in and registration look users up by username:
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
+
+-- The APIs look books up by ISBN, and import.py upserts on it:
+CREATE UNIQUE INDEX IF NOT EXISTS books_isbn_key ON books (isbn);
+
+-- Review writes find the user's review of a book, and the recommendations
+-- find all of a user's reviews, from this index:
+CREATE UNIQUE INDEX IF NOT EXISTS reviews_user_id_book_id_key ON reviews (user_id, book_id);
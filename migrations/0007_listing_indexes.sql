@@ -0,0 +1,14 @@
+-- Indexes matching the WHERE and ORDER BY of the app's listings, so each
+-- page is read straight from an index rather than sorting the table.
+
+-- A book's reviews, newest first, paged by (date, id) - book_details and /api/<isbn>/reviews:
+CREATE INDEX IF NOT EXISTS reviews_book_id_date_idx ON reviews (book_id, date, id);
+
+-- A user's reviews, newest first, paged by (date, id) - user_details:
+CREATE INDEX IF NOT EXISTS reviews_user_id_date_idx ON reviews (user_id, date, id);
+
+-- An author's books in title order, paged by (title, id) - author_details and the home page:
+CREATE INDEX IF NOT EXISTS books_author_title_idx ON books (author, title, id);
+
+-- The ids of the top rated books, read from the index alone - sampling.py:
+CREATE INDEX IF NOT EXISTS books_average_rating_idx ON books (average_rating, id);
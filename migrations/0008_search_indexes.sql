@@ -0,0 +1,9 @@
+-- GiST trigram indexes for title, author and ISBN search (search.py). These
+-- need the pg_trgm extension, which ships with PostgreSQL's contrib modules.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS books_title_trgm_idx ON books USING gist (title gist_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS books_author_trgm_idx ON books USING gist (author gist_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS books_isbn_trgm_idx ON books USING gist (isbn gist_trgm_ops);
@@ -0,0 +1,4 @@
+-- When a book's own details (title, author, year) last changed, set by the
+-- db_seed/import.py upsert - the book APIs' cache headers cover it as well as
+-- reviews_updated. Books already imported start from the time of migration.
+ALTER TABLE books ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP(0);
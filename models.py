@@ -0,0 +1,38 @@
+""" Row models for READ-RATE query results """
+from collections import namedtuple
+
+# A user, with their password hash:
+User = namedtuple("User", "id username hash")
+
+# A book, as listed throughout the site:
+Book = namedtuple("Book", "id isbn title author year review_count average_rating")
+
+# A book returned by the book APIs, with the review aggregates its cache headers are derived from:
+ApiBook = namedtuple("ApiBook", Book._fields + ("rating_total", "reviews_updated", "updated_at"))
+
+# A review shown on a book's page, with its reviewer:
+BookReview = namedtuple("BookReview", "user_id username text date id rating")
+
+# The logged in user's own review of a book:
+OwnReview = namedtuple("OwnReview", "id user_id text date rating")
+
+# A review shown on a user's page, with the book reviewed:
+UserReview = namedtuple("UserReview", "username book_id isbn date title author text id rating")
+
+# A review returned by the reviews API:
+ApiReview = namedtuple("ApiReview", "username date id text rating")
+
+# The lowest and highest book ids, sampled from by the home page:
+BookIdRange = namedtuple("BookIdRange", "low high")
+
+# A GoodReads rating stored in the goodreads_ratings table, fetched_at in epoch seconds:
+StoredRating = namedtuple("StoredRating", "average_rating ratings_count fetched_at")
+
+# A session stored in the sessions table, expires in epoch seconds:
+SessionRecord = namedtuple("SessionRecord", "data expires")
+
+
+def rows(model, result):
+    """Make a list of model tuples straight from the rows of a query result"""
+
+    return list(map(model._make, result))
@@ -0,0 +1,160 @@
+""" In-memory cache of rendered pages and fragments for READ-RATE """
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, session
+
+
+class PageCache:
+    """
+    LRU cache of rendered HTML, bounded by the memory its entries use
+    (max_bytes). Each entry is tagged with the things it shows, e.g.
+    'book:5' for a book's page, its card, and every page its card appears
+    on, so invalidate('book:5') drops exactly the entries a change to book 5
+    makes stale. Entries also expire after ttl seconds, which bounds how
+    long other app processes, whose caches weren't invalidated, serve a
+    stale page.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=60):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry and entry[1] < time.time():
+                self._remove(key)
+                entry = None
+
+            if not entry:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return entry[0]
+
+    def set(self, key, value, tags=()):
+        """Cache value under key, tagged with tags, evicting the least recently used entries to stay under max_bytes"""
+
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.time() + self.ttl, size, tuple(tags))
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Drop every entry tagged with any of tags"""
+
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the cache size and hit, miss, eviction and invalidation counters"""
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def tag(self, *tags):
+        """Tag the page being rendered, if it is to be cached, with things it shows"""
+
+        page_tags = g.get("page_tags")
+        if page_tags is not None:
+            page_tags.update(tags)
+
+    def fragment(self, key, tags, render):
+        """Return the cached fragment for key, rendering and caching it with render() if there is none"""
+
+        self.tag(*tags)
+
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.set(key, value, tags)
+
+        return value
+
+    def page(self, view):
+        """
+        Decorator caching a view's pages for logged out users, by URL and
+        query string. Users who are logged in or have a flashed message
+        waiting always get a fresh render.
+        """
+
+        @wraps(view)
+        def cached_view(*args, **kwargs):
+            if session.get("user_id") is not None or "_flashes" in session:
+                return view(*args, **kwargs)
+
+            key = ("page", request.full_path)
+            page = self.get(key)
+            if page is not None:
+                return page
+
+            # Collect the tags of everything the page shows as it renders:
+            g.page_tags = set()
+            page = view(*args, **kwargs)
+
+            # Redirects and error responses aren't cached:
+            if isinstance(page, str):
+                self.set(key, page, g.page_tags)
+
+            return page
+
+        return cached_view
+
+    def _remove(self, key):
+        value, expires, size, tags = self._entries.pop(key)
+        self._bytes -= size
+
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,128 @@
+""" Password hashing service for READ-RATE, run in a bounded process pool """
+import multiprocessing
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Hash method and cost used for new passwords - werkzeug's PBKDF2 with SHA-256:
+DEFAULT_METHOD = "pbkdf2:sha256:150000"
+DEFAULT_SALT_LENGTH = 8
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated and a request can't be queued in time"""
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(stored_hash, password, method, salt_length, rehash):
+    """Check a password against its hash, and rehash it with the current parameters if asked to"""
+
+    if not check_password_hash(stored_hash, password):
+        return False, None
+
+    return True, _hash(password, method, salt_length) if rehash else None
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords in a pool of worker processes, so a burst of
+    logins doesn't hold up other requests in the app process. At most workers
+    hashes run at once with up to max_queue more waiting - requests beyond
+    that wait up to queue_timeout seconds for a place, then HasherBusy is
+    raised. Stored hashes made with an outdated method or salt length are
+    replaced when their password is next checked.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, salt_length=DEFAULT_SALT_LENGTH, workers=2, max_queue=16, queue_timeout=2):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def hash(self, password):
+        """Return a hash of password made with the current method and salt length"""
+
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, stored_hash, password, rehash=True):
+        """
+        Check password against stored_hash. Returns (matches, new_hash) -
+        new_hash is a fresh hash of the password to store if rehash is set and
+        stored_hash uses outdated parameters, otherwise None.
+        """
+
+        return self._run(_verify, stored_hash, password, self.method, self.salt_length, rehash and self.needs_rehash(stored_hash))
+
+    def needs_rehash(self, stored_hash):
+        """Whether a stored hash was made with a different method or salt length from the current ones"""
+
+        method, _, rest = stored_hash.partition("$")
+        salt = rest.partition("$")[0]
+
+        return method != self.method or len(salt) != self.salt_length
+
+    def stats(self):
+        """Queue depth and latency counters for the hashing pool"""
+
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_ms": self.total_time / self.completed * 1000 if self.completed else 0.0,
+                "max_ms": self.max_time * 1000,
+            }
+
+    def _get_pool(self):
+        """Start the worker processes on first use"""
+
+        with self._lock:
+            if self._pool is None:
+                # Forking an app process with threads running isn't safe, so start workers from a clean server process:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else None)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+        return self._pool
+
+    def _run(self, func, *args):
+        """Run func in the pool, waiting for a free place in the queue for up to queue_timeout"""
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Password hashing is busy, please try again")
+
+        start = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+
+        try:
+            return self._get_pool().submit(func, *args).result()
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+
+            self._slots.release()
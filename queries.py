@@ -0,0 +1,335 @@
+"""
+Data access for READ-RATE - every statement used by the routes, defined once.
+
+Statements are compiled text() constructs, named after the function that
+runs them. Each run is timed and its row count recorded in query_stats, so
+the slowest and busiest queries can be found (and tuned or cached) in one
+place.
+"""
+import threading
+import time
+
+from sqlalchemy import text
+
+from models import Book, ApiBook, BookReview, OwnReview, UserReview, ApiReview, User, rows
+
+BOOK_COLUMNS = "books.id, books.isbn, books.title, books.author, books.year, books.review_count, books.average_rating"
+
+API_BOOK_COLUMNS = BOOK_COLUMNS + ", books.rating_total, books.reviews_updated, books.updated_at"
+
+# Keyset pagination condition and sort order for each paging direction - books
+# are listed by (title, id), and reviews newest first by (date, id):
+BOOK_PAGES = {
+    None: ("", "ASC"),
+    "after": ("AND (books.title, books.id) > (:key_value, :key_id)", "ASC"),
+    "before": ("AND (books.title, books.id) < (:key_value, :key_id)", "DESC"),
+}
+
+REVIEW_PAGES = {
+    None: ("", "DESC"),
+    "after": ("AND (reviews.date, reviews.id) < (:key_value, :key_id)", "DESC"),
+    "before": ("AND (reviews.date, reviews.id) > (:key_value, :key_id)", "ASC"),
+}
+
+
+def average(total, count):
+    """SQL for a book's average rating, rounded to 2 places, from a rating total and review count"""
+
+    return f"COALESCE(ROUND(CAST({total} AS NUMERIC) / NULLIF({count}, 0), 2), 0)"
+
+
+def paged(sql, pages):
+    """Compile a statement for each paging direction, filling in its {condition} and {order}"""
+
+    return dict((direction, text(sql.format(condition=condition, order=order))) for direction, (condition, order) in pages.items())
+
+
+def page_params(cursor, size, **params):
+    """Query parameters for a page of size rows after the cursor values, fetching one extra row to see if there's another page"""
+
+    params.update(key_value=cursor and cursor[0], key_id=cursor and cursor[1], limit=size + 1)
+
+    return params
+
+
+class QueryStats:
+    """Call counts, total and slowest execution times and rows returned for each named query"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, row_count):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0})
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+            stats["rows"] += row_count
+
+    def snapshot(self):
+        """Return a copy of the stats, by query name"""
+
+        with self._lock:
+            return dict((name, dict(stats)) for name, stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+def select_all(name, model, db, statement, params):
+    """Run a named query, returning its rows as a list of model tuples"""
+
+    start = time.perf_counter()
+    result = rows(model, db.execute(statement, params))
+    query_stats.record(name, time.perf_counter() - start, len(result))
+
+    return result
+
+
+def select_one(name, model, db, statement, params):
+    """Run a named query, returning its first row as a model tuple, or None"""
+
+    start = time.perf_counter()
+    row = db.execute(statement, params).fetchone()
+    query_stats.record(name, time.perf_counter() - start, 1 if row else 0)
+
+    return model._make(row) if row else None
+
+
+def select_value(name, db, statement, params):
+    """Run a named query, returning the first column of its first row, or None"""
+
+    start = time.perf_counter()
+    row = db.execute(statement, params).fetchone()
+    query_stats.record(name, time.perf_counter() - start, 1 if row else 0)
+
+    return row[0] if row else None
+
+
+def select_column(name, db, statement, params):
+    """Run a named query, returning the first column of its rows as a list"""
+
+    start = time.perf_counter()
+    values = [row[0] for row in db.execute(statement, params)]
+    query_stats.record(name, time.perf_counter() - start, len(values))
+
+    return values
+
+
+def execute(name, db, statement, params):
+    """Run a named data-modifying statement, returning the number of rows it changed"""
+
+    start = time.perf_counter()
+    row_count = db.execute(statement, params).rowcount
+    query_stats.record(name, time.perf_counter() - start, row_count)
+
+    return row_count
+
+
+# Users:
+
+FIND_USER = text("SELECT id, username, hash FROM users WHERE username = :username")
+
+USERNAME_EXISTS = text("SELECT EXISTS (SELECT 1 FROM users WHERE username = :username)")
+
+ADD_USER = text("INSERT INTO users (username, hash) VALUES (:username, :hash) RETURNING id")
+
+GET_USERNAME = text("SELECT username FROM users WHERE id = :user_id")
+
+GET_PASSWORD_HASH = text("SELECT hash FROM users WHERE id = :user_id")
+
+SET_PASSWORD_HASH = text("UPDATE users SET hash = :hash WHERE id = :user_id")
+
+# The user's reviews are taken off the review counts and rating totals of the
+# books they reviewed as they are deleted, all in one statement, which returns
+# the ids of those books:
+DELETE_USER = text(f"""
+    WITH removed AS (DELETE FROM reviews WHERE user_id = :user_id RETURNING book_id, rating),
+    totals AS (SELECT book_id, COUNT(*) AS review_count, SUM(rating) AS rating_total FROM removed GROUP BY book_id),
+    updated AS (
+        UPDATE books SET review_count = books.review_count - totals.review_count, rating_total = books.rating_total - totals.rating_total,
+            reviews_updated = CURRENT_TIMESTAMP(0), average_rating = {average("books.rating_total - totals.rating_total", "books.review_count - totals.review_count")}
+        FROM totals WHERE books.id = totals.book_id
+    ),
+    deleted AS (DELETE FROM users WHERE id = :user_id)
+    SELECT book_id FROM totals""")
+
+
+def find_user(db, username):
+    """Return the User with a username, or None"""
+
+    return select_one("find_user", User, db, FIND_USER, {"username": username})
+
+
+def username_exists(db, username):
+    return select_value("username_exists", db, USERNAME_EXISTS, {"username": username})
+
+
+def add_user(db, username, password_hash):
+    """Add a user, returning their new user id"""
+
+    return select_value("add_user", db, ADD_USER, {"username": username, "hash": password_hash})
+
+
+def get_username(db, user_id):
+    return select_value("get_username", db, GET_USERNAME, {"user_id": user_id})
+
+
+def get_password_hash(db, user_id):
+    return select_value("get_password_hash", db, GET_PASSWORD_HASH, {"user_id": user_id})
+
+
+def set_password_hash(db, user_id, password_hash):
+    return execute("set_password_hash", db, SET_PASSWORD_HASH, {"user_id": user_id, "hash": password_hash})
+
+
+def delete_user(db, user_id):
+    """Delete a user and all of their reviews, updating the ratings of the books they reviewed. Returns the ids of those books."""
+
+    return select_column("delete_user", db, DELETE_USER, {"user_id": user_id})
+
+
+# Books:
+
+GET_BOOK = text(f"SELECT {BOOK_COLUMNS} FROM books WHERE id = :book_id")
+
+AUTHOR_BOOKS_PAGE = paged(f"SELECT {BOOK_COLUMNS} FROM books WHERE author = :author {{condition}} ORDER BY title {{order}}, id {{order}} LIMIT :limit", BOOK_PAGES)
+
+# Books by an author the user rated a book 4-5 stars, that they haven't reviewed:
+AUTHOR_RECOMMENDATIONS = text(f"""
+    SELECT {BOOK_COLUMNS} FROM books
+    WHERE author IN (SELECT books.author FROM books INNER JOIN reviews ON books.id = reviews.book_id WHERE reviews.user_id = :user_id AND reviews.rating >= 4 ORDER BY RANDOM() LIMIT 1)
+      AND id NOT IN (SELECT book_id FROM reviews WHERE user_id = :user_id)
+    ORDER BY RANDOM() LIMIT :limit""")
+
+GET_API_BOOK = text(f"SELECT {API_BOOK_COLUMNS} FROM books WHERE isbn = :isbn")
+
+GET_API_BOOKS = text(f"SELECT {API_BOOK_COLUMNS} FROM books WHERE isbn = ANY(:isbns) ORDER BY id")
+
+GET_BOOK_ID = text("SELECT id FROM books WHERE isbn = :isbn")
+
+
+def get_book(db, book_id):
+    """Return the Book with an id, or None"""
+
+    return select_one("get_book", Book, db, GET_BOOK, {"book_id": book_id})
+
+
+def author_books_page(db, author, direction, cursor, size):
+    """
+    Return up to size + 1 of an author's books in title order, after or
+    before the (title, id) cursor values when paging in that direction
+    """
+
+    return select_all("author_books_page", Book, db, AUTHOR_BOOKS_PAGE[direction], page_params(cursor, size, author=author))
+
+
+def author_recommendations(db, user_id, limit=6):
+    """Return up to limit books by an author the user has rated highly, that they haven't reviewed"""
+
+    return select_all("author_recommendations", Book, db, AUTHOR_RECOMMENDATIONS, {"user_id": user_id, "limit": limit})
+
+
+def get_api_book(db, isbn):
+    return select_one("get_api_book", ApiBook, db, GET_API_BOOK, {"isbn": isbn})
+
+
+def get_api_books(db, isbns):
+    """Return the ApiBooks for a list of ISBNs, in one query"""
+
+    return select_all("get_api_books", ApiBook, db, GET_API_BOOKS, {"isbns": isbns})
+
+
+def get_book_id(db, isbn):
+    return select_value("get_book_id", db, GET_BOOK_ID, {"isbn": isbn})
+
+
+# Reviews:
+
+BOOK_REVIEWS_PAGE = paged("SELECT users.id, users.username, reviews.text, reviews.date, reviews.id, reviews.rating FROM users INNER JOIN reviews ON users.id = reviews.user_id WHERE reviews.book_id = :book_id {condition} ORDER BY reviews.date {order}, reviews.id {order} LIMIT :limit", REVIEW_PAGES)
+
+USER_REVIEWS_PAGE = paged("SELECT users.username, books.id, books.isbn, reviews.date, books.title, books.author, reviews.text, reviews.id, reviews.rating FROM users INNER JOIN reviews ON users.id = reviews.user_id INNER JOIN books ON reviews.book_id = books.id WHERE users.id = :user_id {condition} ORDER BY reviews.date {order}, reviews.id {order} LIMIT :limit", REVIEW_PAGES)
+
+API_REVIEWS_PAGE = paged("SELECT users.username, reviews.date, reviews.id, reviews.text, reviews.rating FROM users INNER JOIN reviews ON users.id = reviews.user_id WHERE reviews.book_id = :book_id {condition} ORDER BY reviews.date {order}, reviews.id {order} LIMIT :limit", REVIEW_PAGES)
+
+GET_OWN_REVIEW = text("SELECT id, user_id, text, date, rating FROM reviews WHERE user_id = :user_id AND book_id = :book_id")
+
+HAS_REVIEWED = text("SELECT EXISTS (SELECT 1 FROM reviews WHERE user_id = :user_id AND book_id = :book_id)")
+
+# Each review write adjusts the book's review count and rating total, and the
+# user's review count, in the same statement, rather than recounting reviews:
+ADD_REVIEW = text(f"""
+    WITH review AS (
+        INSERT INTO reviews (user_id, book_id, text, rating, date) VALUES (:user_id, :book_id, :text, :rating, CURRENT_TIMESTAMP(0)) RETURNING book_id, rating
+    ),
+    updated AS (
+        UPDATE books SET review_count = books.review_count + 1, rating_total = books.rating_total + review.rating,
+            reviews_updated = CURRENT_TIMESTAMP(0), average_rating = {average("books.rating_total + review.rating", "books.review_count + 1")}
+        FROM review WHERE books.id = review.book_id
+    )
+    UPDATE users SET num_reviews = num_reviews + 1 WHERE id = :user_id""")
+
+EDIT_REVIEW = text(f"""
+    WITH old AS (SELECT id, rating FROM reviews WHERE user_id = :user_id AND book_id = :book_id FOR UPDATE),
+    review AS (
+        UPDATE reviews SET text = :text, rating = :rating, date = CURRENT_TIMESTAMP(0) FROM old WHERE reviews.id = old.id
+        RETURNING reviews.book_id, reviews.rating - old.rating AS delta
+    )
+    UPDATE books SET rating_total = books.rating_total + review.delta,
+        reviews_updated = CURRENT_TIMESTAMP(0), average_rating = {average("books.rating_total + review.delta", "books.review_count")}
+    FROM review WHERE books.id = review.book_id""")
+
+# The user's review count is only decremented if they had a review to delete:
+DELETE_REVIEW = text(f"""
+    WITH review AS (DELETE FROM reviews WHERE user_id = :user_id AND book_id = :book_id RETURNING book_id, rating),
+    updated AS (
+        UPDATE books SET review_count = books.review_count - 1, rating_total = books.rating_total - review.rating,
+            reviews_updated = CURRENT_TIMESTAMP(0), average_rating = {average("books.rating_total - review.rating", "books.review_count - 1")}
+        FROM review WHERE books.id = review.book_id
+    )
+    UPDATE users SET num_reviews = num_reviews - 1 FROM review WHERE users.id = :user_id""")
+
+
+def book_reviews_page(db, book_id, direction, cursor, size):
+    """Return up to size + 1 of a book's reviews, newest first, paged by (date, id) cursor values"""
+
+    return select_all("book_reviews_page", BookReview, db, BOOK_REVIEWS_PAGE[direction], page_params(cursor, size, book_id=book_id))
+
+
+def user_reviews_page(db, user_id, direction, cursor, size):
+    """Return up to size + 1 of a user's reviews, newest first, paged by (date, id) cursor values"""
+
+    return select_all("user_reviews_page", UserReview, db, USER_REVIEWS_PAGE[direction], page_params(cursor, size, user_id=user_id))
+
+
+def api_reviews_page(db, book_id, direction, cursor, size):
+    return select_all("api_reviews_page", ApiReview, db, API_REVIEWS_PAGE[direction], page_params(cursor, size, book_id=book_id))
+
+
+def get_own_review(db, user_id, book_id):
+    """Return the user's OwnReview of a book, or None"""
+
+    return select_one("get_own_review", OwnReview, db, GET_OWN_REVIEW, {"user_id": user_id, "book_id": book_id})
+
+
+def has_reviewed(db, user_id, book_id):
+    return select_value("has_reviewed", db, HAS_REVIEWED, {"user_id": user_id, "book_id": book_id})
+
+
+def add_review(db, user_id, book_id, review_text, rating):
+    return execute("add_review", db, ADD_REVIEW, {"user_id": user_id, "book_id": book_id, "text": review_text, "rating": rating})
+
+
+def edit_review(db, user_id, book_id, review_text, rating):
+    return execute("edit_review", db, EDIT_REVIEW, {"user_id": user_id, "book_id": book_id, "text": review_text, "rating": rating})
+
+
+def delete_review(db, user_id, book_id):
+    """Delete the user's review of a book, returns whether there was one to delete"""
+
+    return execute("delete_review", db, DELETE_REVIEW, {"user_id": user_id, "book_id": book_id}) > 0
@@ -0,0 +1,184 @@
+""" Tiered cache for GoodReads ratings used by READ-RATE book pages """
+import threading
+import time
+
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import QueryPoolFull
+from metrics import Metrics
+from models import StoredRating
+from queries import execute, select_one
+
+# Rating returned when GoodReads has no rating for a book (or can't be reached):
+NO_RATING = ('N/A', 'N/A')
+
+# Persistent tier, shared by all app processes - the goodreads_ratings table (migrations/0003_goodreads_ratings.sql):
+LOAD_RATING = text("SELECT average_rating, ratings_count, EXTRACT(EPOCH FROM fetched_at) FROM goodreads_ratings WHERE isbn=:isbn")
+
+STORE_RATING = text("INSERT INTO goodreads_ratings (isbn, average_rating, ratings_count, fetched_at) VALUES (:isbn, :average_rating, :ratings_count, TO_TIMESTAMP(:fetched_at)) ON CONFLICT (isbn) DO UPDATE SET average_rating=EXCLUDED.average_rating, ratings_count=EXCLUDED.ratings_count, fetched_at=EXCLUDED.fetched_at")
+
+
+class RatingCache:
+    """
+    Caches GoodReads ratings by ISBN in two tiers - an in-process LRU and the
+    goodreads_ratings table. Expired entries are still served while they are
+    refreshed in the background, on pool (a database.QueryPool) if given,
+    so a request only waits on GoodReads for books with no stored rating at
+    all. Refreshes are dropped when the pool is full, or, without a pool,
+    while another refresh is running, so stale pages can't fan out scrapes. 'N/A' results expire sooner than
+    real ratings so books that gain a rating are picked up again.
+    """
+
+    def __init__(self, db, maxsize=4096, ttl=86400, na_ttl=3600, stale_ttl=604800, metrics=None, pool=None):
+        self.db = db
+        self.metrics = metrics or Metrics()
+        self.pool = pool
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.na_ttl = na_ttl
+        self.stale_ttl = stale_ttl
+
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def get(self, isbn):
+        """Return the (average_rating, ratings_count) tuple for a book ISBN"""
+
+        now = time.time()
+
+        # Tier 1 - in-process LRU:
+        with self._lock:
+            entry = self._entries.get(isbn)
+            if entry:
+                self._entries.move_to_end(isbn)
+
+        if entry:
+            rating, fetched_at = entry
+            age = now - fetched_at
+
+            if age < self._ttl_for(rating):
+                self.hits += 1
+                return rating
+
+            if age < self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(isbn)
+                return rating
+
+        # Tier 2 - shared goodreads_ratings table, filled by the app and by
+        # db_seed/harvest_ratings.py. Stored ratings are always served, old
+        # ones are refreshed in the background:
+        stored = self._load(isbn)
+
+        if stored:
+            rating, fetched_at = stored
+            self.db_hits += 1
+            self._remember(isbn, rating, fetched_at)
+
+            if now - fetched_at >= self._ttl_for(rating):
+                self._refresh_in_background(isbn)
+
+            return rating
+
+        # Nothing usable cached, scrape GoodReads now - ending the lookup's transaction first, so its connection goes
+        # back to the pool rather than sitting idle in a transaction for as long as the scrape takes:
+        self.db.rollback()
+        self.misses += 1
+        return self._fetch(isbn)
+
+    def invalidate(self, isbn):
+        """Drop a book's rating from the in-process tier"""
+
+        with self._lock:
+            self._entries.pop(isbn, None)
+
+    def stats(self):
+        """Return the cache hit and miss counters"""
+
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+        }
+
+    def _ttl_for(self, rating):
+        return self.na_ttl if rating == NO_RATING else self.ttl
+
+    def _remember(self, isbn, rating, fetched_at):
+        with self._lock:
+            self._entries[isbn] = (rating, fetched_at)
+            self._entries.move_to_end(isbn)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, isbn):
+        """Scrape a rating from GoodReads and store it in both tiers"""
+
+        # The scraper (and requests) is only loaded once a rating has to be scraped:
+        from goodreads import get_rating
+
+        with self.metrics.external_call("goodreads"):
+            rating = tuple(get_rating(isbn))
+        fetched_at = time.time()
+
+        self._remember(isbn, rating, fetched_at)
+        self._store(isbn, rating, fetched_at)
+
+        return rating
+
+    def _refresh_in_background(self, isbn):
+        with self._lock:
+            if isbn in self._refreshing or (self.pool is None and self._refreshing):
+                return
+            self._refreshing.add(isbn)
+
+        if self.pool is None:
+            threading.Thread(target=self._refresh, args=(None, isbn), daemon=True).start()
+            return
+
+        try:
+            self.pool.submit(self._refresh, isbn)
+        except QueryPoolFull:
+            # Served stale for now, the next view of the book tries again:
+            with self._lock:
+                self._refreshing.discard(isbn)
+
+    def _refresh(self, session, isbn):
+        try:
+            self._fetch(isbn)
+        finally:
+            # Scoped sessions are per thread, release this thread's session:
+            self.db.remove()
+            with self._lock:
+                self._refreshing.discard(isbn)
+
+    def _load(self, isbn):
+        try:
+            row = select_one("load_rating", StoredRating, self.db, LOAD_RATING, {"isbn": isbn})
+        except SQLAlchemyError:
+            self.db.rollback()
+            return None
+
+        if not row:
+            return None
+
+        return (row.average_rating, row.ratings_count), float(row.fetched_at)
+
+    def _store(self, isbn, rating, fetched_at):
+        try:
+            execute("store_rating", self.db, STORE_RATING, {"isbn": isbn, "average_rating": rating[0], "ratings_count": rating[1], "fetched_at": fetched_at})
+            self.db.commit()
+        except SQLAlchemyError:
+            self.db.rollback()
@@ -0,0 +1,185 @@
+"""
+Item-item collaborative filtering recommendations for READ-RATE.
+
+Builds a sparse book-book similarity matrix from the reviews table and stores
+the top NEIGHBOURS most similar books for each book in the book_neighbours
+table (migrations/0004_book_neighbours.sql).
+
+The recommended route then only has to look up the neighbours of the books a
+user rated highly. Rebuild the table periodically (e.g. from a nightly
+scheduled job) to pick up new reviews:
+
+    python3 recommender.py
+"""
+import io
+import os
+import csv
+import time
+
+from sqlalchemy import text
+
+from models import Book
+from queries import select_all
+
+# NumPy and SciPy are only imported by the functions that build the
+# neighbours, so app workers, which only call recommend(), don't load them.
+
+# Most similar books stored for each book:
+NEIGHBOURS = 20
+
+# Reviews rated this or higher count as a user enjoying a book:
+MIN_RATING = 4
+
+# Reviews fetched from the database at a time while building:
+FETCH_SIZE = 100000
+
+# The books most similar to all of the books a user rated highly, that they haven't reviewed:
+RECOMMEND = text("""
+    SELECT books.id, books.isbn, books.title, books.author, books.year, books.review_count, books.average_rating
+    FROM books INNER JOIN (
+        SELECT book_neighbours.neighbour_id, SUM(book_neighbours.score * (reviews.rating - :min_rating + 1)) AS score
+        FROM reviews INNER JOIN book_neighbours ON reviews.book_id = book_neighbours.book_id
+        WHERE reviews.user_id = :user_id AND reviews.rating >= :min_rating
+          AND NOT EXISTS (SELECT 1 FROM reviews AS reviewed WHERE reviewed.user_id = :user_id AND reviewed.book_id = book_neighbours.neighbour_id)
+        GROUP BY book_neighbours.neighbour_id
+        ORDER BY score DESC
+        LIMIT :limit
+    ) AS recommendations ON books.id = recommendations.neighbour_id
+    ORDER BY recommendations.score DESC""")
+
+
+def load_reviews(conn):
+    """Stream all reviews from the database into (user_ids, book_ids, ratings) arrays"""
+    import numpy as np
+
+    cursor = conn.cursor(name="recommender_reviews")
+    cursor.itersize = FETCH_SIZE
+    cursor.execute("SELECT user_id, book_id, rating FROM reviews")
+
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64))
+
+    cursor.close()
+
+    if not chunks:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    reviews = np.concatenate(chunks)
+
+    return reviews[:, 0], reviews[:, 1], reviews[:, 2].astype(np.float32)
+
+
+def build_neighbours(user_ids, book_ids, ratings, neighbours=NEIGHBOURS, block_size=256):
+    """
+    Return (book_ids, neighbour_ids, scores) arrays holding the `neighbours`
+    most similar books for each book, by adjusted cosine similarity - the
+    cosine similarity of the books' ratings after subtracting each user's
+    mean rating. Similarities are computed for blocks of block_size books at
+    a time to bound memory use.
+    """
+    import numpy as np
+    import scipy.sparse as sp
+
+    # Map database ids onto matrix rows and columns:
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    books, book_index = np.unique(book_ids, return_inverse=True)
+
+    # Centre ratings on each user's mean rating:
+    user_totals = np.bincount(user_index, weights=ratings, minlength=len(users))
+    user_counts = np.bincount(user_index, minlength=len(users))
+    centred = ratings - (user_totals / user_counts)[user_index]
+
+    matrix = sp.csc_matrix((centred.astype(np.float32), (user_index, book_index)), shape=(len(users), len(books)))
+
+    # Scale each book's column to unit length, so dot products are cosines:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    # Both operands of the block products are kept in CSR form, otherwise
+    # SciPy converts the whole matrix again for every block:
+    matrix = (matrix @ sp.diags(1 / norms)).tocsr()
+    transposed = matrix.T.tocsr()
+
+    result_books = []
+    result_neighbours = []
+    result_scores = []
+
+    for start in range(0, len(books), block_size):
+        stop = min(start + block_size, len(books))
+        similarities = transposed[start:stop] @ matrix
+
+        for row in range(stop - start):
+            row_start, row_stop = similarities.indptr[row], similarities.indptr[row + 1]
+            columns = similarities.indices[row_start:row_stop]
+            scores = similarities.data[row_start:row_stop]
+
+            # Only keep positively correlated books, excluding the book itself:
+            keep = (scores > 0) & (columns != start + row)
+            columns, scores = columns[keep], scores[keep]
+
+            if len(scores) > neighbours:
+                top = np.argpartition(-scores, neighbours)[:neighbours]
+                columns, scores = columns[top], scores[top]
+
+            result_books.append(np.full(len(columns), books[start + row]))
+            result_neighbours.append(books[columns])
+            result_scores.append(scores)
+
+    if not result_books:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    return np.concatenate(result_books), np.concatenate(result_neighbours), np.concatenate(result_scores)
+
+
+def store_neighbours(conn, book_ids, neighbour_ids, scores):
+    """Replace the contents of book_neighbours in a single transaction"""
+    import numpy as np
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows(zip(book_ids.tolist(), neighbour_ids.tolist(), np.round(scores, 4).tolist()))
+    buffer.seek(0)
+
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM book_neighbours")
+    cursor.copy_expert("COPY book_neighbours (book_id, neighbour_id, score) FROM STDIN WITH (FORMAT csv)", buffer)
+    conn.commit()
+
+
+def rebuild(engine):
+    """Rebuild the book_neighbours table from the reviews table"""
+
+    conn = engine.raw_connection()
+
+    try:
+        start = time.time()
+        user_ids, book_ids, ratings = load_reviews(conn)
+        print(f"Loaded {len(ratings)} reviews in {time.time() - start:.1f}s")
+
+        start = time.time()
+        neighbours = build_neighbours(user_ids, book_ids, ratings)
+        print(f"Found {len(neighbours[0])} book neighbours in {time.time() - start:.1f}s")
+
+        store_neighbours(conn, *neighbours)
+    finally:
+        conn.close()
+
+
+def recommend(db, user_id, limit=6):
+    """
+    Return up to limit books the user hasn't reviewed, scored by their
+    similarity to all of the books the user rated MIN_RATING or higher
+    """
+
+    return select_all("recommend", Book, db, RECOMMEND, {"user_id": user_id, "min_rating": MIN_RATING, "limit": limit})
+
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+
+    print("Rebuilding book recommendations...")
+    rebuild(create_engine(os.getenv("DATABASE_URL")))
+    print("Book recommendations rebuilt!")
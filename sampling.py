@@ -0,0 +1,147 @@
+""" Random book sampling for the READ-RATE home page without ORDER BY RANDOM() """
+import random
+import threading
+import time
+
+from sqlalchemy import text
+
+from models import Book, BookIdRange
+from queries import select_all, select_column, select_one
+
+# Minimum average rating for a book to appear in the Top Rated section:
+TOP_RATING = 4.5
+
+# Pool loads, run by _load() in the background - they read whole columns of the books table by design:
+TOP_RATED_IDS = text("SELECT id FROM books WHERE average_rating >= :rating")
+
+AUTHOR_NAMES = text("SELECT DISTINCT author FROM books")
+
+BOOK_ID_RANGE = text("SELECT MIN(id), MAX(id) FROM books")
+
+# Statements run for each home page:
+TOP_RATED_BOOKS = text("SELECT id, isbn, title, author, year, review_count, average_rating FROM books WHERE id = ANY(:ids) AND average_rating >= :rating")
+
+BOOKS_BY_ID = text("SELECT id, isbn, title, author, year, review_count, average_rating FROM books WHERE id = ANY(:ids)")
+
+AUTHOR_BOOKS = text("SELECT id, isbn, title, author, year, review_count, average_rating FROM books WHERE author = :author LIMIT :limit")
+
+
+class BookSampler:
+    """
+    Draws random books from candidate pools held in memory - the ids of the
+    top rated books, the list of authors and the range of book ids - so each
+    home page section costs a fetch of a handful of rows by primary key
+    rather than a sort of the whole books table. Pools are reloaded in the
+    background once they are older than ttl seconds. Reviews only change the
+    book ratings, so after invalidate_ratings() just the top rated ids are
+    reloaded in the background.
+    """
+
+    def __init__(self, db, ttl=600):
+        self.db = db
+        self.ttl = ttl
+
+        self._top_ids = []
+        self._authors = []
+        self._id_range = (0, 0)
+        self._loaded_at = None
+        self._ratings_stale = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def top_rated(self, n=6):
+        """Return up to n random books rated TOP_RATING or above"""
+
+        self._check_pools()
+
+        ids = random.sample(self._top_ids, min(n, len(self._top_ids)))
+
+        # Ratings may have dropped since the pool was loaded, so check again:
+        return select_all("top_rated_books", Book, self.db, TOP_RATED_BOOKS, {"ids": ids, "rating": TOP_RATING})
+
+    def lucky_dip(self, n=6, attempts=3):
+        """Return up to n random books, picked by sampling the book id range"""
+
+        self._check_pools()
+
+        low, high = self._id_range
+        books = []
+
+        # Oversample to allow for gaps in the ids left by deleted books:
+        for _ in range(attempts):
+            if high < low:
+                break
+
+            ids = random.sample(range(low, high + 1), min(n * 2, high - low + 1))
+            seen = [book.id for book in books]
+            ids = [book_id for book_id in ids if book_id not in seen]
+
+            books += select_all("books_by_id", Book, self.db, BOOKS_BY_ID, {"ids": ids})
+
+            if len(books) >= n:
+                break
+
+        return books[:n]
+
+    def author_books(self, n=6):
+        """Return up to n books by one randomly chosen author"""
+
+        self._check_pools()
+
+        if not self._authors:
+            return []
+
+        return select_all("author_books", Book, self.db, AUTHOR_BOOKS, {"author": random.choice(self._authors), "limit": n})
+
+    def load(self):
+        """Load the pools now rather than on first use, e.g. before the app's workers are forked"""
+
+        with self._lock:
+            self._load()
+
+    def invalidate_ratings(self):
+        """Mark the top rated ids as out of date, they are reloaded in the background"""
+
+        self._ratings_stale = True
+
+    def _check_pools(self):
+        # First use loads the pools before sampling, after that they are
+        # refreshed in the background while the old pools are used:
+        if self._loaded_at is None:
+            with self._lock:
+                if self._loaded_at is None:
+                    self._load()
+
+        elif self._ratings_stale or time.time() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+
+            full = time.time() - self._loaded_at > self.ttl
+            threading.Thread(target=self._refresh, args=(full,), daemon=True).start()
+
+    def _refresh(self, full):
+        try:
+            if full:
+                self._load()
+            else:
+                self._load_top_ids()
+        finally:
+            # Scoped sessions are per thread, release this thread's session:
+            self.db.remove()
+            self._refreshing = False
+
+    def _load(self):
+        self._load_top_ids()
+        authors = select_column("author_names", self.db, AUTHOR_NAMES, {})
+        id_range = select_one("book_id_range", BookIdRange, self.db, BOOK_ID_RANGE, {})
+
+        self._authors = authors
+        self._id_range = (id_range.low or 0, id_range.high or -1)
+        self._loaded_at = time.time()
+
+    def _load_top_ids(self):
+        # Cleared before the query, so reviews written while it runs mark the ids stale again:
+        self._ratings_stale = False
+        self._top_ids = select_column("top_rated_ids", self.db, TOP_RATED_IDS, {"rating": TOP_RATING})
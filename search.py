@@ -0,0 +1,63 @@
+""" Title, author and ISBN search for READ-RATE using PostgreSQL trigram indexes """
+from itertools import groupby
+
+from sqlalchemy import text
+
+from models import Book
+from queries import select_all
+
+# Search types offered by the search bar, mapped to the books column searched:
+SEARCH_FIELDS = {
+    "title": "title",
+    "author": "author",
+    "isbn": "isbn",
+}
+
+# The GiST trigram indexes of migrations/0008_search_indexes.sql serve both
+# the substring match (ILIKE '%text%') and the similarity ranking
+# (column <-> text) straight from the index. Postgres keeps them up to date
+# as books are inserted, so imports need no extra step.
+
+# The closest matches to the search text in each searchable column:
+SEARCH_BOOKS = dict((search_type, text(f"SELECT id, isbn, title, author, year, review_count, average_rating FROM books WHERE {column} ILIKE :pattern ORDER BY {column} <-> :text LIMIT :limit"))
+                    for search_type, column in SEARCH_FIELDS.items())
+
+# The closest matching authors, each with up to :books of their books:
+SEARCH_AUTHOR_BOOKS = text("""
+    SELECT author_books.id, author_books.isbn, author_books.title, author_books.author, author_books.year, author_books.review_count, author_books.average_rating
+    FROM (SELECT author FROM books WHERE author ILIKE :pattern GROUP BY author ORDER BY author <-> :text LIMIT :authors) AS names
+    CROSS JOIN LATERAL (SELECT id, isbn, title, author, year, review_count, average_rating FROM books WHERE books.author = names.author ORDER BY id LIMIT :books) AS author_books
+    ORDER BY names.author <-> :text, names.author, author_books.id""")
+
+
+def like_pattern(text):
+    """Turn search text into an ILIKE substring pattern, escaping any wildcards"""
+
+    text = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    return "%" + text + "%"
+
+
+def search_books(db, search_type, text, limit=30):
+    """
+    Return up to limit books whose search_type column contains text, closest
+    matches first. Raises ValueError for a search_type that isn't searchable.
+    """
+
+    if search_type not in SEARCH_FIELDS:
+        raise ValueError(f"Cannot search books by {search_type}")
+
+    return select_all("search_books", Book, db, SEARCH_BOOKS[search_type], {"pattern": like_pattern(text), "text": text, "limit": limit})
+
+
+def search_author_books(db, text, authors=10, books=6):
+    """
+    Return a list of up to `authors` author names containing text, closest
+    matches first, each paired with a list of up to `books` of their books.
+    All of the authors' books are fetched in a single query.
+    """
+
+    matches = select_all("search_author_books", Book, db, SEARCH_AUTHOR_BOOKS, {"pattern": like_pattern(text), "text": text, "authors": authors, "books": books})
+
+    # Rows arrive grouped by author, so split them up in one pass:
+    return [(name, list(author_books)) for name, author_books in groupby(matches, key=lambda book: book.author)]
@@ -0,0 +1,211 @@
+""" Pluggable session backends for READ-RATE """
+import os
+import secrets
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+from models import SessionRecord
+from queries import execute, select_one
+
+# Server side session store, shared by all app nodes - the sessions table (migrations/0005_sessions.sql):
+LOAD_SESSION = text("SELECT data, EXTRACT(EPOCH FROM expires) FROM sessions WHERE id=:id AND expires > CURRENT_TIMESTAMP")
+
+STORE_SESSION = text("INSERT INTO sessions (id, data, expires) VALUES (:id, :data, CURRENT_TIMESTAMP + :ttl * INTERVAL '1 second') ON CONFLICT (id) DO UPDATE SET data=EXCLUDED.data, expires=EXCLUDED.expires")
+
+TOUCH_SESSION = text("UPDATE sessions SET expires = CURRENT_TIMESTAMP + :ttl * INTERVAL '1 second' WHERE id=:id")
+
+DELETE_SESSION = text("DELETE FROM sessions WHERE id=:id")
+
+PURGE_SESSIONS = text("DELETE FROM sessions WHERE expires < CURRENT_TIMESTAMP")
+
+# Backends selected by the SESSION_BACKEND environment variable:
+SESSION_BACKENDS = ("cookie", "database", "memory")
+
+
+class MemoryStore:
+    """
+    Session store kept in a dict in this process - a stand-in for the
+    database store in tests and single process development servers
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        """Return the stored (data, expiry time) of a session id, or None if there is none"""
+
+        with self._lock:
+            entry = self._sessions.get(sid)
+
+            if entry and entry[1] < time.time():
+                del self._sessions[sid]
+                entry = None
+
+        return entry
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._sessions[sid] = (data, time.time() + ttl)
+
+    def touch(self, sid, ttl):
+        """Push back the expiry of a session, leaving its data as it is"""
+
+        with self._lock:
+            if sid in self._sessions:
+                self._sessions[sid] = (self._sessions[sid][0], time.time() + ttl)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class DatabaseStore:
+    """
+    Session store in the sessions table, so any app node can serve any user.
+    Each write runs in its own short transaction on a pooled connection,
+    separate from the request's session, and expired sessions are deleted
+    every purge_every writes.
+    """
+
+    def __init__(self, engine, purge_every=1000):
+        self.engine = engine
+        self.purge_every = purge_every
+        self._writes = 0
+
+    def get(self, sid):
+        """Return the stored (data, expiry time) of a session id, or None if there is none"""
+
+        with self.engine.connect() as conn:
+            row = select_one("load_session", SessionRecord, conn, LOAD_SESSION, {"id": sid})
+
+        return (row.data, float(row.expires)) if row else None
+
+    def set(self, sid, data, ttl):
+        self._writes += 1
+
+        with self.engine.begin() as conn:
+            execute("store_session", conn, STORE_SESSION, {"id": sid, "data": data, "ttl": ttl})
+
+            if self._writes % self.purge_every == 0:
+                execute("purge_sessions", conn, PURGE_SESSIONS, {})
+
+    def touch(self, sid, ttl):
+        """Push back the expiry of a session, leaving its data as it is"""
+
+        with self.engine.begin() as conn:
+            execute("touch_session", conn, TOUCH_SESSION, {"id": sid, "ttl": ttl})
+
+    def delete(self, sid):
+        with self.engine.begin() as conn:
+            execute("delete_session", conn, DELETE_SESSION, {"id": sid})
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """Session data kept in a store under a random session id"""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+
+        # The user the session was loaded for - a new session id is issued when this changes:
+        self.loaded_user = self.get("user_id")
+
+
+class StoreSessionInterface(SessionInterface):
+    """
+    Keeps session data in a store, with only a random session id in the
+    cookie. The store is only written to when the session has changed, or to
+    push back the expiry of a session in use once it is past half of its ttl.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, ttl=86400):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+
+        if sid:
+            stored = self.store.get(sid)
+            if stored is not None:
+                data, expires = stored
+                return StoredSession(self.serializer.loads(data), sid=sid, expires=expires)
+
+        return StoredSession()
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session.modified:
+            # Keep a session in use from expiring, without a write on every request - only once it's past half of its ttl:
+            if session.sid and session.expires - time.time() < self.ttl / 2:
+                self.store.touch(session.sid, self.ttl)
+                self.set_cookie(app, session, response)
+            return
+
+        # Logging out or emptying the session removes it from the store:
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        # Issue a new session id on log in or out, so an old id can't be reused:
+        if session.sid and session.get("user_id") != session.loaded_user:
+            self.store.delete(session.sid)
+            session.sid = None
+
+        if not session.sid:
+            session.sid = secrets.token_urlsafe(32)
+
+        self.store.set(session.sid, self.serializer.dumps(dict(session)), self.ttl)
+        self.set_cookie(app, session, response)
+
+    def set_cookie(self, app, session, response):
+        """Send the session id cookie, with a fresh expiry time"""
+
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=self.get_cookie_domain(app), path=self.get_cookie_path(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def init_sessions(app, engine, backend=None):
+    """
+    Set up the app's sessions with the given backend (default: the
+    SESSION_BACKEND environment variable, or 'cookie'):
+      cookie - the session is kept in a cookie signed with SECRET_KEY, with no server side state
+      database - the session is kept in the sessions table, shared by all app nodes
+      memory - the session is kept in this process, for tests
+    """
+
+    backend = backend or os.getenv("SESSION_BACKEND", "cookie")
+
+    if backend not in SESSION_BACKENDS:
+        raise RuntimeError(f"SESSION_BACKEND must be one of: {', '.join(SESSION_BACKENDS)}")
+
+    if backend == "cookie":
+        # All app nodes must share the key to read each other's cookies:
+        if not app.secret_key:
+            raise RuntimeError("SECRET_KEY is not set")
+        app.session_interface = SecureCookieSessionInterface()
+    elif backend == "database":
+        app.session_interface = StoreSessionInterface(DatabaseStore(engine))
+    else:
+        app.session_interface = StoreSessionInterface(MemoryStore())
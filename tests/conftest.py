@@ -0,0 +1,143 @@
+"""
+Fixtures for READ-RATE's tests. Tests that need PostgreSQL run against the
+database in TEST_DATABASE_URL, migrated to the latest schema, and are
+skipped when it isn't set. Each test's writes are rolled back afterwards:
+
+    TEST_DATABASE_URL=postgresql://localhost/readrate_test python3 -m pytest
+
+Tests of code that scrapes GoodReads use the goodreads fixture, a fake
+GoodReads server on a local port.
+"""
+import os
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import migrate  # noqa: E402
+
+# The first migration that needs the pg_trgm extension:
+TRIGRAM_MIGRATION = 8
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture(scope="session")
+def engine():
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    engine = create_engine(url)
+
+    # Without contrib's pg_trgm, apply all of the migrations but the search indexes:
+    with engine.connect() as conn:
+        engine.trigram = bool(conn.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar())
+
+    migrate.migrate(engine, skip=() if engine.trigram else (TRIGRAM_MIGRATION,))
+
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """A session whose writes are all rolled back at the end of the test"""
+
+    conn = engine.connect()
+    transaction = conn.begin()
+    session = Session(bind=conn)
+
+    yield session
+
+    session.close()
+    transaction.rollback()
+    conn.close()
+
+
+@pytest.fixture
+def statements(db):
+    """A list of the SQL statements run by db, from when the test clears it"""
+
+    executed = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    conn = db.connection()
+    event.listen(conn, "before_cursor_execute", count_statement)
+    yield executed
+    event.remove(conn, "before_cursor_execute", count_statement)
+
+
+@pytest.fixture
+def add_books(db):
+    """Returns a function adding count books by an author, which returns their ids"""
+
+    def add(author, count):
+        return [db.execute("INSERT INTO books (isbn, title, author, year) VALUES (:isbn, :title, :author, 2000) RETURNING id",
+                           {"isbn": f"test-{author}-{i}", "title": f"{author} book {i}", "author": author}).scalar()
+                for i in range(count)]
+
+    return add
+
+
+class FakeGoodReads(BaseHTTPRequestHandler):
+    """
+    Answers /book/isbn/<isbn> with the statuses queued for the ISBN in
+    server.errors, then with the fixture book page for ISBNs in server.books
+    and 404 for the rest. ISBNs in server.slow are answered after half a
+    second. Each request is logged in server.requests as (isbn, time).
+    """
+
+    def do_GET(self):
+        server = self.server
+        isbn = self.path.rsplit("/", 1)[-1]
+        server.requests.append((isbn, time.monotonic()))
+
+        if isbn in server.slow:
+            time.sleep(0.5)
+
+        if server.errors.get(isbn):
+            status, body = server.errors[isbn].pop(0), b"Error"
+        elif isbn in server.books:
+            with open(os.path.join(FIXTURES, "goodreads_book.html"), "rb") as f:
+                status, body = 200, f.read()
+        else:
+            status, body = 404, b"Not found"
+
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def goodreads():
+    """A fake GoodReads server (see FakeGoodReads), with its address in base_url"""
+
+    server = HTTPServer(("127.0.0.1", 0), FakeGoodReads)
+    server.books = set()
+    server.errors = {}
+    server.slow = set()
+    server.requests = []
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,30 @@
+""" Tests for database.py """
+import os
+
+import pytest
+from sqlalchemy.orm import Session
+
+from database import create_db_engine
+
+
+@pytest.fixture
+def timed_engine(engine):
+    """An engine with a TimedQueuePool on the test database, once it is migrated"""
+
+    timed_engine = create_db_engine(os.getenv("TEST_DATABASE_URL"))
+    yield timed_engine
+    timed_engine.dispose()
+
+
+def test_every_checkout_is_timed(timed_engine):
+    with timed_engine.connect() as conn:
+        conn.execute("SELECT 1")
+
+    conn = timed_engine.raw_connection()
+    conn.close()
+
+    session = Session(bind=timed_engine)
+    session.execute("SELECT 1")
+    session.close()
+
+    assert timed_engine.pool.stats()["checkouts"] == 3
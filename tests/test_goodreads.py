@@ -0,0 +1,21 @@
+""" Tests for goodreads.py, against a local fake GoodReads server """
+from goodreads import get_rating
+
+BOOK_ISBN = "0380795272"
+
+
+def test_rating_is_parsed_from_the_book_page(goodreads):
+    goodreads.books.add(BOOK_ISBN)
+
+    assert get_rating(BOOK_ISBN, base_url=goodreads.base_url) == ("3.84", "12345")
+
+
+def test_unknown_book_has_no_rating(goodreads):
+    assert get_rating("0000000000", base_url=goodreads.base_url) == ("N/A", "N/A")
+
+
+def test_slow_response_has_no_rating(goodreads):
+    goodreads.books.add(BOOK_ISBN)
+    goodreads.slow.add(BOOK_ISBN)
+
+    assert get_rating(BOOK_ISBN, timeout=0.1, base_url=goodreads.base_url) == ("N/A", "N/A")
@@ -0,0 +1,70 @@
+""" Tests for db_seed/harvest_ratings.py, against a local fake GoodReads server """
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "db_seed"))
+
+from harvest_ratings import RateLimiter, fetch_rating, pending_isbns, store_ratings  # noqa: E402
+
+BOOK_ISBN = "0380795272"
+RATING = ("3.84", "12345")
+
+
+def fetch(goodreads, isbn, limiter=None, retries=3, backoff=0.05):
+    return fetch_rating(requests.Session(), limiter or RateLimiter(0), goodreads.base_url, isbn, retries, backoff, timeout=2)
+
+
+def test_rate_limits_and_server_errors_are_retried_with_backoff(goodreads):
+    goodreads.books.add(BOOK_ISBN)
+    goodreads.errors[BOOK_ISBN] = [429, 503]
+
+    assert fetch(goodreads, BOOK_ISBN) == RATING
+
+    times = [at for _, at in goodreads.requests]
+    assert len(times) == 3
+    # Each wait is backoff * 2 ** attempt, jittered by 0.5-1.5x:
+    assert times[1] - times[0] >= 0.05 * 0.5
+    assert times[2] - times[1] >= 0.1 * 0.5
+
+
+def test_book_is_left_for_the_next_run_once_out_of_retries(goodreads):
+    goodreads.books.add(BOOK_ISBN)
+    goodreads.errors[BOOK_ISBN] = [500] * 5
+
+    assert fetch(goodreads, BOOK_ISBN, retries=2, backoff=0.01) is None
+    assert len(goodreads.requests) == 3
+
+
+def test_book_not_on_goodreads_has_no_rating_without_retrying(goodreads):
+    assert fetch(goodreads, "0000000000") == ("N/A", "N/A")
+    assert len(goodreads.requests) == 1
+
+
+def test_rate_limiter_spaces_out_requests(goodreads):
+    goodreads.books.add(BOOK_ISBN)
+    limiter = RateLimiter(20)
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        ratings = list(pool.map(lambda _: fetch(goodreads, BOOK_ISBN, limiter), range(5)))
+
+    assert ratings == [RATING] * 5
+    times = sorted(at for _, at in goodreads.requests)
+    assert times[-1] - times[0] >= 4 * 0.05 * 0.9
+    assert all(later - earlier >= 0.05 * 0.5 for earlier, later in zip(times, times[1:]))
+
+
+def test_books_with_a_stored_rating_are_skipped(db, add_books):
+    add_books("Testauthor Harvest", 3)
+    isbns = [f"test-Testauthor Harvest-{i}" for i in range(3)]
+
+    store_ratings(db, [(isbns[0], RATING)])
+
+    pending = pending_isbns(db)
+    assert isbns[0] not in pending
+    assert isbns[1] in pending and isbns[2] in pending
+
+    assert set(isbns) <= set(pending_isbns(db, refresh=True))
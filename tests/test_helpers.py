@@ -0,0 +1,29 @@
+""" Tests for helpers.py """
+import base64
+import json
+
+from datetime import datetime, timezone
+
+from helpers import date_key, decode_cursor, encode_cursor, page_request, text_key
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def test_cursor_round_trip():
+    date = datetime(2019, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+
+    assert decode_cursor(encode_cursor([date, 7]), date_key) == [date, 7]
+    assert decode_cursor(encode_cursor(["Emma", 7]), text_key) == ["Emma", 7]
+
+
+def test_cursor_with_wrong_key_type_is_first_page():
+    for key_type, values in ((date_key, ["not a date", 1]), (date_key, [1, 1]), (text_key, [1, 1]), (text_key, [None, 1]),
+                             (text_key, ["Emma", "1"]), (text_key, ["Emma", True]), (text_key, ["Emma"])):
+        assert decode_cursor(cursor(values), key_type) is None
+        assert page_request({"after": cursor(values)}, 20, 100, key_type) == (None, None, 20)
+
+
+def test_garbled_cursor_is_first_page():
+    assert page_request({"before": "not base64!", "limit": "500"}, 20, 100, date_key) == (None, None, 100)
@@ -0,0 +1,21 @@
+""" Tests for queries.py """
+import pytest
+
+import queries
+
+
+@pytest.mark.parametrize("reviews", [1, 30])
+def test_delete_user_statement_count(db, statements, add_books, reviews):
+    book_ids = add_books("Testauthor Delete", reviews)
+    user_id = queries.add_user(db, "test-delete-user", "hash")
+    for book_id in book_ids:
+        queries.add_review(db, user_id, book_id, "Test review", 4)
+    statements.clear()
+
+    changed = queries.delete_user(db, user_id)
+
+    assert len(statements) == 1
+    assert sorted(changed) == sorted(book_ids)
+    assert queries.find_user(db, "test-delete-user") is None
+    assert db.execute("SELECT COUNT(*) FROM reviews WHERE user_id = :user_id", {"user_id": user_id}).scalar() == 0
+    assert db.execute("SELECT SUM(review_count) FROM books WHERE id = ANY(:ids)", {"ids": book_ids}).scalar() == 0
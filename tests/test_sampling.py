@@ -0,0 +1,62 @@
+""" Tests for sampling.py """
+import threading
+
+import pytest
+
+import sampling
+from sampling import BookSampler
+
+
+class ScopedSession:
+    """The test's session, standing in for the app's scoped session"""
+
+    def __init__(self, session):
+        self.session = session
+
+    def execute(self, *args, **kwargs):
+        return self.session.execute(*args, **kwargs)
+
+    def remove(self):
+        pass
+
+
+class InlineThread(threading.Thread):
+    """Runs the sampler's background refreshes inline, so the test can check them"""
+
+    def start(self):
+        self.run()
+
+
+@pytest.fixture
+def sampler(db, monkeypatch):
+    monkeypatch.setattr(sampling.threading, "Thread", InlineThread)
+    sampler = BookSampler(ScopedSession(db))
+    sampler.load()
+    return sampler
+
+
+def test_review_changes_reload_only_the_top_rated_ids(sampler, db, statements, add_books):
+    book_id = add_books("Testauthor Sampling", 1)[0]
+    db.execute("UPDATE books SET average_rating = 5 WHERE id = :id", {"id": book_id})
+    statements.clear()
+
+    sampler.invalidate_ratings()
+    sampler.top_rated()
+
+    assert book_id in sampler._top_ids
+    assert not any("DISTINCT author" in statement or "MIN(id)" in statement for statement in statements)
+
+    statements.clear()
+    sampler.top_rated()
+
+    assert not any("SELECT id FROM books WHERE average_rating" in statement for statement in statements)
+
+
+def test_expired_pools_are_all_reloaded(sampler, statements):
+    sampler._loaded_at -= sampler.ttl + 1
+    statements.clear()
+
+    sampler.top_rated()
+
+    assert any("DISTINCT author" in statement for statement in statements)
+    assert any("MIN(id)" in statement for statement in statements)
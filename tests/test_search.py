@@ -0,0 +1,20 @@
+""" Tests for search.py """
+import pytest
+
+from search import search_author_books
+
+
+@pytest.mark.parametrize("books", [1, 6, 20])
+def test_author_search_runs_one_statement(db, statements, add_books, books):
+    if not db.get_bind().engine.trigram:
+        pytest.skip("pg_trgm is not available")
+
+    for author in ("Testauthor Alpha", "Testauthor Beta", "Testauthor Gamma"):
+        add_books(author, books)
+    statements.clear()
+
+    results = search_author_books(db, "Testauthor", authors=10, books=6)
+
+    assert len(statements) == 1
+    assert [name for name, _ in results] == ["Testauthor Alpha", "Testauthor Beta", "Testauthor Gamma"]
+    assert all(len(author_books) == min(books, 6) for _, author_books in results)
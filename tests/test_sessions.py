@@ -0,0 +1,57 @@
+""" Tests for sessions.py """
+import time
+
+import pytest
+from flask import session
+
+from application import create_app
+
+
+@pytest.fixture
+def app():
+    app = create_app({"DATABASE_URL": "postgresql://localhost/unused", "API_KEY": "test", "SECRET_KEY": "test",
+                      "SESSION_BACKEND": "memory", "PRELOAD": False})
+    app.session_interface.ttl = 100
+
+    @app.route("/test/login")
+    def login():
+        session["user_id"] = 1
+        return ""
+
+    @app.route("/test/read")
+    def read():
+        return str(session.get("user_id"))
+
+    return app
+
+
+def test_stored_session_expiry_is_refreshed_past_half_its_ttl(app, monkeypatch):
+    store = app.session_interface.store
+    client = app.test_client()
+    now = time.time()
+
+    def at(seconds, path="/test/read"):
+        monkeypatch.setattr(time, "time", lambda: now + seconds)
+        return client.get(path)
+
+    response = at(0, "/test/login")
+    assert "Set-Cookie" in response.headers
+    sid = next(iter(store._sessions))
+
+    # Early on, reading the session writes nothing:
+    response = at(40)
+    assert response.get_data(as_text=True) == "1"
+    assert "Set-Cookie" not in response.headers
+    assert store.get(sid)[1] == now + 100
+
+    # Past half of its ttl, the store and the cookie get a fresh expiry, once:
+    response = at(60)
+    assert "Set-Cookie" in response.headers
+    assert store.get(sid)[1] == now + 160
+
+    response = at(70)
+    assert "Set-Cookie" not in response.headers
+
+    # A session that isn't used expires:
+    response = at(300)
+    assert response.get_data(as_text=True) == "None"